@@ -0,0 +1,101 @@
+from typing import List, Dict, Any, Optional
+import json
+import logging
+from .azure_openai_client import http_client, build_kql_messages, build_kql_request_body, clean_kql_response, encode_json
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_API_VERSION = "2024-12-01-preview"
+
+def _headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {settings.azure_openai_key}"}
+
+def _url(path: str) -> str:
+    return f"{settings.azure_openai_endpoint}/openai/{path}?api-version={_API_VERSION}"
+
+def build_batch_file(prompts: List[Dict[str, Any]]) -> bytes:
+    """Build the JSONL input file for a batch job
+
+    Args:
+        prompts: List of dicts with keys: natural_language and optionally context
+    """
+    lines = []
+    for i, prompt in enumerate(prompts):
+        messages = build_kql_messages(prompt['natural_language'], prompt.get('context'))
+        lines.append(encode_json({
+            "custom_id": f"task-{i}",
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": build_kql_request_body(messages)
+        }))
+    return b"\n".join(lines) + b"\n"
+
+async def submit_batch(prompts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Upload prompts as a JSONL file and create a batch job for them
+
+    Batch jobs trade latency (up to 24h) for roughly half the per-token cost,
+    so this is meant for bulk work such as offline evaluation or feedback replay.
+    """
+    upload = await http_client.post(
+        _url("files"),
+        headers=_headers(),
+        data={"purpose": "batch"},
+        files={"file": ("nl2kql_batch.jsonl", build_batch_file(prompts), "application/jsonl")}
+    )
+    upload.raise_for_status()
+    input_file_id = upload.json()["id"]
+    logger.info(f"Uploaded batch input file {input_file_id} with {len(prompts)} prompts")
+
+    response = await http_client.post(
+        _url("batches"),
+        headers=_headers(),
+        json={
+            "input_file_id": input_file_id,
+            "endpoint": "/chat/completions",
+            "completion_window": "24h"
+        }
+    )
+    response.raise_for_status()
+    batch = response.json()
+    logger.info(f"Created batch job {batch['id']} (status: {batch.get('status')})")
+    return batch
+
+async def poll_batch(batch_id: str) -> Dict[str, Any]:
+    """Get the current state of a batch job"""
+    response = await http_client.get(_url(f"batches/{batch_id}"), headers=_headers())
+    response.raise_for_status()
+    return response.json()
+
+async def fetch_results(output_file_id: str) -> List[Dict[str, Any]]:
+    """Download a batch output file and extract the KQL for each prompt, in input order"""
+    response = await http_client.get(_url(f"files/{output_file_id}/content"), headers=_headers())
+    response.raise_for_status()
+
+    results = []
+    for line in response.text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        index = int(entry["custom_id"].split("-", 1)[1])
+        body = (entry.get("response") or {}).get("body") or {}
+        error: Optional[str] = None
+        kql_query = None
+        if entry.get("error"):
+            error = str(entry["error"])
+        elif body.get("choices"):
+            kql_query = clean_kql_response(body["choices"][0]["message"]["content"])
+        else:
+            error = str(body.get("error", "Empty response"))
+        results.append({"index": index, "kql_query": kql_query, "error": error})
+
+    results.sort(key=lambda x: x["index"])
+    return results
+
+async def get_batch_results(batch_id: str) -> Dict[str, Any]:
+    """Return the batch status, plus results once the job has completed"""
+    batch = await poll_batch(batch_id)
+    result = {"batch_id": batch_id, "status": batch.get("status"), "results": None}
+    if batch.get("status") == "completed" and batch.get("output_file_id"):
+        result["results"] = await fetch_results(batch["output_file_id"])
+    return result
@@ -0,0 +1,105 @@
+from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import time
+from .azure_openai_client import (
+    http_client, build_kql_messages, build_kql_request_body, clean_kql_response, encode_json,
+    retry_after_seconds, AOAI_URL, AOAI_HEADERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Rough allowance for the completion when estimating the token cost of a request
+_COMPLETION_TOKEN_ESTIMATE = 300
+# How long to wait for the deployment's rate-limit window to refill once it is exhausted
+_REFILL_SECONDS = 1.0
+
+class RateLimiter:
+    """Token bucket fed by the x-ratelimit-remaining-* headers of previous responses"""
+
+    def __init__(self):
+        self.remaining_tokens: Optional[int] = None
+        self.remaining_requests: Optional[int] = None
+        self.blocked_until = 0.0
+
+    def block_for(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self, estimated_tokens: int):
+        """Wait until the deployment is expected to accept a request of this size"""
+        while True:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            out_of_requests = self.remaining_requests is not None and self.remaining_requests <= 0
+            out_of_tokens = self.remaining_tokens is not None and self.remaining_tokens < estimated_tokens
+            if out_of_requests or out_of_tokens:
+                # Wait for the window to refill, then trust the next response headers again
+                self.block_for(_REFILL_SECONDS)
+                self.remaining_tokens = None
+                self.remaining_requests = None
+                continue
+
+            if self.remaining_tokens is not None:
+                self.remaining_tokens -= estimated_tokens
+            if self.remaining_requests is not None:
+                self.remaining_requests -= 1
+            return
+
+    def update(self, headers):
+        """Refresh the bucket from the rate-limit headers of a response"""
+        tokens = headers.get("x-ratelimit-remaining-tokens")
+        requests = headers.get("x-ratelimit-remaining-requests")
+        if tokens is not None and tokens.isdigit():
+            self.remaining_tokens = int(tokens)
+        if requests is not None and requests.isdigit():
+            self.remaining_requests = int(requests)
+
+async def _complete(prompt: Dict[str, Any], limiter: RateLimiter, max_retries: int) -> str:
+    """Generate KQL for a single prompt, backing off on 429 responses"""
+    messages = build_kql_messages(prompt['natural_language'], prompt.get('context'))
+    estimated_tokens = sum(len(m["content"]) for m in messages) // 4 + _COMPLETION_TOKEN_ESTIMATE
+    content = encode_json(build_kql_request_body(messages))
+
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(estimated_tokens)
+        response = await http_client.post(AOAI_URL, headers=AOAI_HEADERS, content=content)
+        limiter.update(response.headers)
+
+        if response.status_code == 429 and attempt < max_retries:
+            delay = max(retry_after_seconds(response.headers) or 0.0, 2 ** attempt)
+            logger.warning(f"Rate limited by Azure OpenAI, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            limiter.block_for(delay)
+            continue
+
+        response.raise_for_status()
+        return clean_kql_response(response.json()["choices"][0]["message"]["content"])
+
+async def run_many(prompts: List[Dict[str, Any]], workers: int = 8, max_retries: int = 5) -> List[str]:
+    """Generate KQL for many prompts concurrently, at most `workers` requests in flight
+
+    Args:
+        prompts: List of dicts with keys: natural_language and optionally context
+
+    Returns:
+        KQL strings in input order; failed prompts yield a '// Error: ...' comment
+    """
+    limiter = RateLimiter()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run_one(prompt: Dict[str, Any]) -> str:
+        async with semaphore:
+            return await _complete(prompt, limiter, max_retries)
+
+    results = await asyncio.gather(*(run_one(p) for p in prompts), return_exceptions=True)
+
+    kql_queries = []
+    for prompt, result in zip(prompts, results):
+        if isinstance(result, Exception):
+            logger.error(f"Parallel generation failed for '{prompt['natural_language']}': {result}")
+            kql_queries.append(f"// Error: {str(result)}")
+        else:
+            kql_queries.append(result)
+    return kql_queries
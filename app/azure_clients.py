@@ -0,0 +1,40 @@
+from azure.identity.aio import DefaultAzureCredential
+from azure.monitor.query.aio import LogsQueryClient
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# One credential for every Azure SDK client, so tokens are fetched and cached once per process
+_credential = None
+_logs_client = None
+_lock = asyncio.Lock()
+
+async def get_credential() -> DefaultAzureCredential:
+    global _credential
+    if _credential is None:
+        async with _lock:
+            if _credential is None:
+                # DefaultAzureCredential will use AZURE_SUBSCRIPTION_ID from env if set
+                _credential = DefaultAzureCredential(exclude_interactive_browser_credential=True)
+    return _credential
+
+async def get_logs_client() -> LogsQueryClient:
+    global _logs_client
+    if _logs_client is None:
+        credential = await get_credential()
+        async with _lock:
+            if _logs_client is None:
+                _logs_client = LogsQueryClient(credential)
+                logger.info("Initialized async LogsQueryClient with the shared DefaultAzureCredential.")
+    return _logs_client
+
+async def close_azure_clients():
+    """Close the shared Azure SDK clients, then the credential they use"""
+    global _credential, _logs_client
+    if _logs_client is not None:
+        await _logs_client.close()
+        _logs_client = None
+    if _credential is not None:
+        await _credential.close()
+        _credential = None
@@ -1,8 +1,160 @@
-import requests
+import asyncio
+import hashlib
+import logging
+import random
+import time
+import httpx
+import msgspec
+from typing import Optional
+from .cache import TTLCache
 from .config import settings
+from .kql_text import strip_fences
+from .semantic_cache import semantic_cache
 
-def get_kql_from_nl(natural_language: str, context: str = None) -> str:
-    print("AOAI Client settings:", settings.model_dump())
+logger = logging.getLogger(__name__)
+
+# Shared async client so the TCP/TLS connection to Azure OpenAI is reused across calls
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(30.0, connect=3.05),
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=3,  # Connection-level retries only; status retries are handled below
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+)
+
+# Blocking counterpart for code that runs in worker threads (schema description generation)
+sync_http_client = httpx.Client(
+    timeout=httpx.Timeout(30.0, connect=3.05),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    )
+)
+
+AOAI_MODEL = "gpt-4.1-2025-04-14"
+# Settings are fixed for the lifetime of the process, so the endpoint URL and headers are built once
+AOAI_URL = f"{settings.azure_openai_endpoint}/openai/deployments/{AOAI_MODEL}/chat/completions?api-version=2024-12-01-preview"
+AOAI_HEADERS = {
+    "Authorization": f"Bearer {settings.azure_openai_key}",
+    "Content-Type": "application/json"
+}
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_MAX_RETRIES = 3
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Read the server-suggested delay from Retry-After / retry-after-ms"""
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Delay before retrying a 429/5xx: the server's Retry-After if given, else jittered exponential backoff"""
+    delay = retry_after_seconds(response.headers)
+    if delay is None:
+        delay = 0.3 * (2 ** attempt) + random.random() * 0.2
+    logger.warning(
+        f"Azure OpenAI returned {response.status_code}, retrying in {delay:.2f}s (attempt {attempt + 1}/{_MAX_RETRIES})"
+    )
+    return delay
+
+async def _backoff(response: httpx.Response, attempt: int):
+    await asyncio.sleep(_retry_delay(response, attempt))
+
+def post_with_retry_sync(url: str, headers: dict, content: bytes) -> httpx.Response:
+    """Blocking post_with_retry through sync_http_client, for code running in worker threads"""
+    for attempt in range(_MAX_RETRIES + 1):
+        response = sync_http_client.post(url, headers=headers, content=content)
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            return response
+        time.sleep(_retry_delay(response, attempt))
+    return response
+
+async def post_with_retry(url: str, headers: dict, content: bytes) -> httpx.Response:
+    """POST a pre-encoded JSON body through the shared client, retrying with backoff on 429/5xx"""
+    for attempt in range(_MAX_RETRIES + 1):
+        response = await http_client.post(url, headers=headers, content=content)
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            return response
+        await _backoff(response, attempt)
+    return response
+
+def _closing_fence_end(text: str) -> int:
+    """End offset of the fence closing a leading markdown code block, or -1 if it is still open"""
+    start = len(text) - len(text.lstrip())
+    if not text.startswith("```", start):
+        return -1
+    first_newline = text.find("\n", start)
+    if first_newline == -1:
+        return -1
+    closing = text.find("```", first_newline)
+    return -1 if closing == -1 else closing + 3
+
+async def stream_completion_with_retry(url: str, headers: dict, content: bytes) -> str:
+    """POST a pre-encoded streaming chat body and return the generated text
+
+    Tokens are accumulated from the server-sent events as they arrive. Once a fenced
+    code block has been closed the stream is abandoned, so any explanation the model
+    adds after the query is not waited for.
+    Retries with backoff on 429/5xx like post_with_retry.
+    """
+    for attempt in range(_MAX_RETRIES + 1):
+        async with http_client.stream("POST", url, headers=headers, content=content) as response:
+            if response.status_code in _RETRY_STATUSES and attempt < _MAX_RETRIES:
+                await _backoff(response, attempt)
+                continue
+            if response.status_code != 200:
+                await response.aread()
+                response.raise_for_status()
+
+            parts = []
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                choices = msgspec.json.decode(payload).get("choices")
+                # Azure sends prompt filter results in a first chunk without choices
+                if not choices:
+                    continue
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    parts.append(token)
+                    if "`" in token:
+                        text = "".join(parts)
+                        end = _closing_fence_end(text)
+                        if end != -1:
+                            return text[:end]
+            return "".join(parts)
+
+async def close_http_client():
+    await http_client.aclose()
+    sync_http_client.close()
+
+# Process-local cache of generated KQL keyed by a hash of the full prompt
+_response_cache = TTLCache(maxsize=512, ttl_seconds=3600)
+
+def _cache_key(model: str, system_message: str, user_message: str) -> bytes:
+    """Build a stable cache key from everything that is sent to the model"""
+    return hashlib.sha256(
+        b"\0".join(part.encode("utf-8") for part in (model, system_message, user_message))
+    ).digest()
+
+def build_kql_messages(natural_language: str, context: str = None) -> list:
+    """Build the chat messages used for basic NL to KQL generation"""
     # Updated system prompt to be less aggressive with projecting columns
     system_message_content = (
         "You are an assistant that ONLY returns valid Kusto Query Language (KQL) queries. "
@@ -13,34 +165,60 @@ def get_kql_from_nl(natural_language: str, context: str = None) -> str:
     if context:
         system_message_content += f" Use the following context if provided: {context}"
 
-    messages = [
+    return [
         {"role": "system", "content": system_message_content},
         {"role": "user", "content": f"{natural_language}"}
-    ] 
-    headers = {
-        "Authorization": f"Bearer {settings.azure_openai_key}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "messages": messages,
-        "temperature": 0.2, # Reduced temperature for more deterministic KQL
-        "top_p": 1.0,
-        "frequency_penalty": 0.0,
-        "presence_penalty": 0.0,
-        "model": "gpt-4.1-2025-04-14"
-    }
-    response = requests.post(
-        f"{settings.azure_openai_endpoint}/openai/deployments/gpt-4.1-2025-04-14/chat/completions?api-version=2024-12-01-preview",
-        headers=headers,
-        json=data
-    )
+    ]
+
+class ChatCompletionsBody(msgspec.Struct, frozen=True):
+    """Request body for basic NL to KQL generation; only the messages vary between calls"""
+    messages: list
+    temperature: float = 0.2 # Reduced temperature for more deterministic KQL
+    top_p: float = 1.0
+    frequency_penalty: float = 0.0
+    presence_penalty: float = 0.0
+    model: str = AOAI_MODEL
+
+# Fixed-shape structs are encoded straight to JSON bytes in C
+encode_json = msgspec.json.Encoder().encode
+
+def build_kql_request_body(messages: list) -> ChatCompletionsBody:
+    """Request body for basic NL to KQL generation"""
+    return ChatCompletionsBody(messages=messages)
+
+def clean_kql_response(kql: str) -> str:
+    """Strip whitespace and markdown fences from a model response"""
+    return strip_fences(kql)
+
+async def get_kql_from_nl(natural_language: str, context: str = None, no_cache: bool = False, workspace_id: str = None) -> str:
+    messages = build_kql_messages(natural_language, context)
+    system_message_content = messages[0]["content"]
+    body = build_kql_request_body(messages)
+
+    # Repeated prompts (retries, UI reloads) are served from the cache unless the caller opts out
+    cache_key = _cache_key(body.model, system_message_content, natural_language)
+    embedding = None
+    if not no_cache:
+        cached_kql = _response_cache.get(cache_key)
+        if cached_kql is not None:
+            return cached_kql
+
+        # Paraphrases of an earlier prompt are answered from the semantic cache; the prompt's
+        # embedding is kept for storing the new entry on a miss
+        embedding = await asyncio.to_thread(semantic_cache.embed, natural_language)
+        cached_kql = await asyncio.to_thread(
+            semantic_cache.lookup, natural_language, workspace_id=workspace_id, context=context, embedding=embedding
+        )
+        if cached_kql is not None:
+            _response_cache.set(cache_key, cached_kql)
+            return cached_kql
+
+    response = await post_with_retry(AOAI_URL, headers=AOAI_HEADERS, content=encode_json(body))
     response.raise_for_status()
-    kql = response.json()["choices"][0]["message"]["content"].strip()
-    # Remove potential markdown backticks from KQL
-    if kql.startswith("```kusto"):
-        kql = kql[len("```kusto"):].strip()
-    if kql.startswith("```"):
-        kql = kql[len("```"):].strip()
-    if kql.endswith("```"):
-        kql = kql[:-len("```")].strip()
-    return kql 
\ No newline at end of file
+    kql = clean_kql_response(response.json()["choices"][0]["message"]["content"])
+
+    _response_cache.set(cache_key, kql)
+    await asyncio.to_thread(
+        semantic_cache.store, natural_language, kql, workspace_id=workspace_id, context=context, embedding=embedding
+    )
+    return kql
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, Optional
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed time-to-live"""
+
+    def __init__(self, maxsize: int = 512, ttl_seconds: float = 3600):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                # Expired entries are evicted lazily on lookup
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Store value under key, evicting the least recently used entry when full"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class DiskCache:
+    """Thread-safe persistent string cache in a single SQLite table, shared across runs
+
+    Failures to read or write the file are logged and treated as misses.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Return the cached values for whichever of keys are present"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(keys))})", keys
+                ).fetchall()
+            return dict(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache {self.path} unavailable: {e}")
+            return {}
+
+    def set_many(self, items: Dict[str, str]):
+        """Store several values in one transaction"""
+        if not items:
+            return
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", items.items())
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache {self.path} unavailable: {e}")
+
+    def clear(self):
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            logger.warning(f"Disk cache {self.path} unavailable: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def set(self, key: str, value: str):
+        self.set_many({key: value})
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -9,8 +10,22 @@ class Settings(BaseSettings):
     # For Log Analytics via azure-monitor-query
     azure_subscription_id: Optional[str] = None # Can be used by DefaultAzureCredential
     log_analytics_workspace_id: Optional[str] = None # Changed back from workspace_name
+    
+    # How long multi-RAG generation results are reused for a repeated prompt; 0 disables the cache
+    rag_result_cache_ttl_seconds: float = 3600
+    # How long a populated vector store snapshot is trusted on startup before the workspace is re-discovered
+    rag_snapshot_ttl_seconds: float = 86400
+    # How long discovered tables and table schemas are served from the on-disk cache; 0 disables it
+    schema_cache_ttl_seconds: float = 3600
+    # Run the embedder in FP16 on CUDA GPUs; set to false for full FP32 embeddings
+    embedder_half_precision: bool = True
 
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache()
+def get_settings() -> Settings:
+    """Read the environment / .env once and reuse the same Settings instance"""
+    return Settings()
+
+settings = get_settings()
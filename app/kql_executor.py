@@ -1,28 +1,81 @@
-from azure.identity import DefaultAzureCredential
-from azure.monitor.query import LogsQueryClient, LogsQueryStatus
+from azure.monitor.query import LogsQueryStatus, LogsBatchQuery
 from azure.core.exceptions import HttpResponseError
+from .azure_clients import get_logs_client
+from .cache import TTLCache
 from .config import settings
 from datetime import timedelta
+from typing import List
 import logging
 
+try:
+    import psutil
+except ImportError:  # Memory-pressure scaling of the result cache TTL is optional
+    psutil = None
+
 logger = logging.getLogger(__name__)
 
-_credential = None
-_logs_client = None # Renaming back from _log_analytics_client for clarity
+# Short-lived cache of successful results, for dashboards re-running the same query on a cadence
+_result_cache = TTLCache(maxsize=256, ttl_seconds=60)
+_MEMORY_PRESSURE_PERCENT = 80
+
+def _result_ttl() -> float:
+    """Cache TTL, scaled linearly down to zero as memory use goes from 80% to 100%"""
+    ttl = _result_cache.ttl_seconds
+    if psutil is None:
+        return ttl
+    used_percent = psutil.virtual_memory().percent
+    if used_percent <= _MEMORY_PRESSURE_PERCENT:
+        return ttl
+    return ttl * max(0.0, (100 - used_percent) / (100 - _MEMORY_PRESSURE_PERCENT))
+
+def _process_tables(tables) -> list:
+    """Convert SDK LogsTable objects into plain {name, columns, rows} dicts"""
+    processed_tables = []
+    for table in tables:
+        if hasattr(table, 'name') and hasattr(table, 'columns') and hasattr(table, 'rows'):
+            processed_tables.append({
+                "name": table.name,
+                # azure-monitor-query 2.x returns column names as plain strings
+                "columns": [col if isinstance(col, str) else col.name for col in table.columns],
+                "rows": [list(row) for row in table.rows]
+            })
+        else:
+            logger.warning(f"Skipping malformed table object in response: {table}")
+    return processed_tables
+
+def _convert_response(response, cache_key: tuple):
+    """Turn a query response into processed tables, or a partial/failure dict, caching full successes"""
+    logger.info(f"Log Analytics API Response Status: {response.status}")
 
-def get_logs_client(): # Renaming back
-    global _credential, _logs_client
-    if _logs_client is None:
-        _credential = DefaultAzureCredential() # DefaultAzureCredential will use AZURE_SUBSCRIPTION_ID from env if set
-        _logs_client = LogsQueryClient(_credential)
-        logger.info("Initialized LogsQueryClient with DefaultAzureCredential.")
-    return _logs_client
+    if response.status == LogsQueryStatus.SUCCESS:
+        processed_tables = _process_tables(response.tables or [])
+        if processed_tables:
+            # Row contents are only formatted when debug logging is enabled; large results
+            # made the old per-query info dumps the most expensive part of the call
+            logger.info("Query returned %d table(s), %d row(s)",
+                        len(processed_tables), sum(len(t["rows"]) for t in processed_tables))
+            logger.debug("Processed tables: %s", processed_tables)
+        else:
+            logger.info("Query returned successfully but with no tables/data.")
+        # Only complete results are cached; partial and failed queries always go back to the service
+        ttl = _result_ttl()
+        if ttl > 0:
+            _result_cache.set(cache_key, processed_tables, ttl_seconds=ttl)
+        return processed_tables
+    elif response.status == LogsQueryStatus.PARTIAL:
+        logger.warning(f"Log Analytics query returned partial data. Error: {response.partial_error}")
+        processed_tables = _process_tables(response.partial_data or [])
+        return {"data": processed_tables, "error": str(response.partial_error), "status": "PartialSuccess"}
+    else: # LogsQueryStatus.FAILURE; batch queries return the LogsQueryError itself
+        error = getattr(response, "error", response)
+        logger.error(f"Log Analytics query failed. Error details: {error}")
+        return {"error": str(error), "status": "Failure"}
 
-def execute_kql(kql_query: str, 
-                workspace_id: str = None, # Changed back from individual params
-                timespan_days: int = 1):
+async def execute_kql(kql_query: str, 
+                      workspace_id: str = None, # Changed back from individual params
+                      timespan_days: int = 1):
     
-    client = get_logs_client()
+    client = await get_logs_client()
     
     # Use workspace_id from request or fallback to settings
     ws_id = workspace_id or settings.log_analytics_workspace_id
@@ -36,54 +89,60 @@ def execute_kql(kql_query: str,
     logger.info(f"KQL Query: {kql_query}")
     logger.info(f"Timespan: {timespan_days} day(s)")
 
+    cache_key = (ws_id, kql_query, timespan_days)
+    cached_tables = _result_cache.get(cache_key)
+    if cached_tables is not None:
+        logger.info("Returning cached Log Analytics result")
+        return cached_tables
+
     try:
-        response = client.query_workspace(
+        response = await client.query_workspace(
             workspace_id=ws_id, 
             query=kql_query, 
             timespan=timedelta(days=timespan_days)
         )
-        logger.info(f"Log Analytics API Response Status: {response.status}")
-
-        if response.status == LogsQueryStatus.SUCCESS:
-            logger.info(f"Log Analytics API Response Tables (raw): {response.tables}")
-            processed_tables = []
-            if response.tables:
-                for table in response.tables:
-                    if hasattr(table, 'name') and hasattr(table, 'columns') and hasattr(table, 'rows'):
-                        logger.info(f"Table columns: {table.columns}")
-                        processed_tables.append({
-                            "name": table.name,
-                            "columns": [col.name for col in table.columns if hasattr(col, 'name')],
-                            "rows": [list(row) for row in table.rows]
-                        })
-                    else:
-                        logger.warning(f"Skipping malformed table object in response: {table}")
-            else:
-                logger.info("Query returned successfully but with no tables/data.")
-            logger.info(f"Processed tables: {processed_tables}")
-            return processed_tables
-        elif response.status == LogsQueryStatus.PARTIAL:
-            logger.warning(f"Log Analytics query returned partial data. Error: {response.partial_error}")
-            processed_tables = []
-            if response.partial_data:
-                 for table in response.partial_data:
-                    if hasattr(table, 'name') and hasattr(table, 'columns') and hasattr(table, 'rows'):
-                        logger.info(f"Table columns: {table.columns}")
-                        processed_tables.append({
-                            "name": table.name,
-                            "columns": [col.name for col in table.columns if hasattr(col, 'name')],
-                            "rows": [list(row) for row in table.rows]
-                        })
-                    else:
-                        logger.warning(f"Skipping malformed table object in partial_data: {table}")
-            return {"data": processed_tables, "error": str(response.partial_error), "status": "PartialSuccess"}
-        else: # LogsQueryStatus.FAILURE
-            logger.error(f"Log Analytics query failed. Error details: {response.error}")
-            return {"error": str(response.error), "status": "Failure"}
+        return _convert_response(response, cache_key)
 
     except HttpResponseError as e:
         logger.error(f"HttpResponseError during Log Analytics query for workspace {ws_id}: {e.message}", exc_info=True)
         raise # Re-raise to let FastAPI handle it as a 500
     except Exception as e:
         logger.error(f"Unexpected error during Log Analytics query for workspace {ws_id}: {e}", exc_info=True)
-        raise # Re-raise for FastAPI to handle 
\ No newline at end of file
+        raise # Re-raise for FastAPI to handle 
+
+async def execute_kql_batch(kql_queries: List[str], workspace_id: str = None, timespan_days: int = 1) -> list:
+    """Execute several KQL queries against one workspace in a single batch request
+
+    Returns one entry per query, in order, shaped like the return value of execute_kql.
+    """
+    client = await get_logs_client()
+
+    ws_id = workspace_id or settings.log_analytics_workspace_id
+    if not ws_id:
+        error_msg = "Log Analytics Workspace ID is not provided. Please set it in .env or include in the request."
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+
+    results = [None] * len(kql_queries)
+    pending = []
+    for i, kql_query in enumerate(kql_queries):
+        cached_tables = _result_cache.get((ws_id, kql_query, timespan_days))
+        if cached_tables is not None:
+            results[i] = cached_tables
+        else:
+            pending.append(i)
+
+    if pending:
+        logger.info(f"Executing batch of {len(pending)} KQL queries on Workspace ID: {ws_id}")
+        try:
+            responses = await client.query_batch([
+                LogsBatchQuery(workspace_id=ws_id, query=kql_queries[i], timespan=timedelta(days=timespan_days))
+                for i in pending
+            ])
+        except HttpResponseError as e:
+            logger.error(f"HttpResponseError during Log Analytics batch query for workspace {ws_id}: {e.message}", exc_info=True)
+            raise
+        for i, response in zip(pending, responses):
+            results[i] = _convert_response(response, (ws_id, kql_queries[i], timespan_days))
+
+    return results
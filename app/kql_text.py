@@ -0,0 +1,8 @@
+import re
+
+# Opening ```kusto / ```kql / ``` fences and closing ``` fences, on any line
+_FENCE_RE = re.compile(r'^[ \t]*```(?:kusto|kql)?\s*|\s*```\s*$', re.MULTILINE)
+
+def strip_fences(text: str) -> str:
+    """Remove markdown code fences around a KQL query"""
+    return _FENCE_RE.sub('', text).strip()
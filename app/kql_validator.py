@@ -1,37 +1,111 @@
 import re
+from collections import Counter
 from typing import List, Dict, Any, Optional, Tuple
 import logging
+from functools import lru_cache
+from .kql_text import strip_fences
 
 logger = logging.getLogger(__name__)
 
+try:
+    from rapidfuzz import process
+    from rapidfuzz.distance import Levenshtein
+except ImportError:  # Fall back to the pure-Python banded distance below
+    process = None
+
+# Patterns are compiled once at import time; validation runs on every generated query
+_INLINE_TICK = re.compile(r'^`([^`]+)`$')
+_TABLE_LINE = re.compile(r'^([A-Za-z][A-Za-z0-9_]*)\s*(?:\||$)')
+_IDENTIFIER_START = re.compile(r'^[A-Za-z][A-Za-z0-9_]*')
+
+# ago(7) / ago(7 days) -> ago(7d), ago(24 hours) -> ago(24h), ago(30 minutes) -> ago(30m)
+_AGO_PATTERN = re.compile(r'ago\s*\(\s*(\d+)\s*(days?|hours?|minutes?|)\s*\)', re.IGNORECASE)
+_AGO_UNITS = {'': 'd', 'd': 'd', 'h': 'h', 'm': 'm'}
+
+_WORD_RE = re.compile(r'[a-z]+')
+_FUNC_CALL_RE = re.compile(r'\b([a-z_]+)\s*\(')
+_AGGREGATION_FUNCTIONS = frozenset({'count', 'sum', 'avg', 'min', 'max', 'dcount'})
+
+_STRING_ASSIGNMENT = re.compile(r'(\w+)\s*=\s*("[^"]*")')
+
+_FUNCTION_FIXES = [
+    (wrong, correct, re.compile(r'\b' + re.escape(wrong), re.IGNORECASE))
+    for wrong, correct in {
+        'length(': 'strlen(',
+        'len(': 'strlen(',
+        'substring(': 'substr(',
+        'isnull(': 'isempty(',
+        'notnull(': 'isnotempty(',
+    }.items()
+]
+
+# Tabular operators tracked for complexity scoring and operator sanity checks
+_OP_RE = re.compile(r'\b(where|project|summarize|join|union|order\s+by|sort\s+by|take|limit)\b', re.IGNORECASE)
+
+def _count_operators(query: str) -> Counter:
+    """Count operator keywords in a single pass over the query"""
+    return Counter(' '.join(m.group(1).lower().split()) for m in _OP_RE.finditer(query))
+
+def _lev_le(s1: str, s2: str, k: int = 2) -> int:
+    """Levenshtein distance if it is at most k, otherwise k + 1
+
+    Only the diagonal band of width 2k + 1 of the DP table is computed, and
+    the scan stops as soon as every cell in a row exceeds k.
+    """
+    if abs(len(s1) - len(s2)) > k:
+        return k + 1
+    too_far = k + 1
+    previous_row = list(range(len(s2) + 1))
+    for i in range(1, len(s1) + 1):
+        current_row = [too_far] * (len(s2) + 1)
+        if i <= k:
+            current_row[0] = i
+        for j in range(max(1, i - k), min(len(s2), i + k) + 1):
+            current_row[j] = min(
+                previous_row[j] + 1,  # deletion
+                current_row[j - 1] + 1,  # insertion
+                previous_row[j - 1] + (s1[i - 1] != s2[j - 1])  # substitution
+            )
+        if min(current_row) > k:
+            return too_far
+        previous_row = current_row
+    return min(previous_row[-1], too_far)
+
+def _normalize_ago(match: re.Match) -> str:
+    return f"ago({match.group(1)}{_AGO_UNITS[match.group(2)[:1].lower()]})"
+
 class KQLValidator:
     """Validates and corrects KQL syntax and common errors"""
     
     def __init__(self):
         # Common KQL operators and functions
-        self.kql_operators = {
+        self.kql_operators = frozenset({
             'where', 'project', 'extend', 'summarize', 'order', 'sort', 'take', 'limit',
             'join', 'union', 'distinct', 'top', 'sample', 'render', 'let', 'datatable'
-        }
+        })
         
-        self.kql_functions = {
+        self.kql_functions = frozenset({
             'count', 'sum', 'avg', 'min', 'max', 'dcount', 'countif', 'sumif',
             'ago', 'now', 'datetime', 'timespan', 'bin', 'floor', 'ceiling',
             'strlen', 'substring', 'split', 'strcat', 'replace', 'trim',
             'tolower', 'toupper', 'contains', 'startswith', 'endswith',
             'isempty', 'isnotempty', 'isnull', 'isnotnull', 'iff', 'case'
-        }
+        })
         
-        self.time_functions = {'ago', 'now', 'datetime', 'timespan', 'bin'}
+        self.time_functions = frozenset({'ago', 'now', 'datetime', 'timespan', 'bin'})
         
         # Common table names in Log Analytics
-        self.common_tables = {
+        self.common_tables = frozenset({
             'SecurityEvent', 'Syslog', 'Event', 'Heartbeat', 'Perf', 'Alert',
             'AzureActivity', 'SigninLogs', 'AuditLogs', 'AppServiceHTTPLogs',
             'ContainerLog', 'KubeEvents', 'InsightsMetrics', 'VMConnection',
             'SecurityAlert', 'SecurityIncident', 'ThreatIntelligenceIndicator',
             'Usage', 'Operation', 'ConfigurationChange', 'ConfigurationData'
-        }
+        })
+        
+        # LLM output repeats a lot at low temperature, so identical inputs are memoized
+        self._validate_cached = lru_cache(maxsize=1024)(self._validate)
+        self._complexity_cached = lru_cache(maxsize=1024)(self._complexity_score)
     
     def validate_and_correct(self, kql_query: str, available_tables: List[str] = None) -> Tuple[str, List[str], bool]:
         """
@@ -40,123 +114,159 @@ class KQLValidator:
         Returns:
             Tuple of (corrected_query, warnings, is_valid)
         """
-        warnings = []
-        corrected_query = kql_query.strip()
-        
-        # Remove markdown formatting if present
-        corrected_query = self._remove_markdown(corrected_query)
-        
-        # Basic syntax checks
-        corrected_query, syntax_warnings = self._check_basic_syntax(corrected_query)
-        warnings.extend(syntax_warnings)
-        
-        # Check table names
-        corrected_query, table_warnings = self._check_table_names(corrected_query, available_tables)
-        warnings.extend(table_warnings)
-        
-        # Check time filters
-        corrected_query, time_warnings = self._check_time_filters(corrected_query)
-        warnings.extend(time_warnings)
-        
-        # Check operators and functions
-        operator_warnings = self._check_operators_and_functions(corrected_query)
-        warnings.extend(operator_warnings)
-        
-        # Check for common mistakes
-        corrected_query, mistake_warnings = self._fix_common_mistakes(corrected_query)
-        warnings.extend(mistake_warnings)
-        
-        # Final validation
-        is_valid = self._final_validation(corrected_query)
-        
-        return corrected_query, warnings, is_valid
+        corrected_query, warnings, is_valid = self._validate_cached(kql_query, tuple(available_tables or ()))
+        return corrected_query, list(warnings), is_valid
     
-    def _remove_markdown(self, query: str) -> str:
-        """Remove markdown code block formatting"""
-        # Remove ```kusto or ```kql blocks
-        query = re.sub(r'^```(?:kusto|kql)?\s*\n?', '', query, flags=re.MULTILINE)
-        query = re.sub(r'\n?```\s*$', '', query, flags=re.MULTILINE)
+    def _validate(self, kql_query: str, available_tables: Tuple[str, ...]) -> Tuple[str, Tuple[str, ...], bool]:
+        """
+        Uncached body of validate_and_correct
         
-        # Remove inline code backticks
-        query = re.sub(r'^`([^`]+)`$', r'\1', query.strip())
+        All line-level checks and corrections are applied in a single pass over
+        the query; warnings are still reported grouped by check.
+        """
+        syntax_warnings = []
+        table_warnings = []
+        time_warnings = []
+        operator_warnings = []
+        mistake_warnings = []
         
-        return query.strip()
-    
-    def _check_basic_syntax(self, query: str) -> Tuple[str, List[str]]:
-        """Check basic KQL syntax"""
-        warnings = []
-        corrected = query
+        # Remove markdown formatting if present (fences may span lines)
+        corrected_query = self._remove_markdown(kql_query.strip())
         
         # Check for missing semicolons (not required in KQL but sometimes added)
-        if corrected.endswith(';'):
-            corrected = corrected[:-1]
-            warnings.append("Removed unnecessary semicolon at end of query")
-        
-        # Check for proper pipe usage
-        lines = corrected.split('\n')
+        if corrected_query.endswith(';'):
+            corrected_query = corrected_query[:-1]
+            syntax_warnings.append("Removed unnecessary semicolon at end of query")
+        
+        table_set = set(available_tables) if available_tables else None
+        operators = Counter()
+        funcs_present = set()
+        fixed_functions = set()
+        time_format_fixed = False
+        has_time_filter = False
+        has_summarize = False
+        project_after_summarize = False
+        assignment_fixed = False
+        first_line = None
+        paren_balance = 0
         corrected_lines = []
         
-        for i, line in enumerate(lines):
+        for i, line in enumerate(corrected_query.split('\n')):
             line = line.strip()
             if not line:
                 continue
-                
-            # First line should not start with pipe
+            
+            # Basic syntax: first line should not start with pipe
             if i == 0 and line.startswith('|'):
                 line = line[1:].strip()
-                warnings.append("Removed unnecessary pipe at beginning of query")
+                syntax_warnings.append("Removed unnecessary pipe at beginning of query")
             
             # Other lines should start with pipe (except comments and table names)
-            elif i > 0 and line and not line.startswith('|') and not line.startswith('//'):
+            elif i > 0 and not line.startswith('|') and not line.startswith('//'):
                 # Check if this looks like a continuation of the previous line
-                if any(op in line.lower() for op in self.kql_operators):
+                if self.kql_operators & set(_WORD_RE.findall(line.lower())):
                     line = '| ' + line
-                    warnings.append(f"Added missing pipe before '{line[:20]}...'")
+                    syntax_warnings.append(f"Added missing pipe before '{line[:20]}...'")
+            
+            # Table names
+            if not line.startswith('//') and not line.startswith('|'):
+                match = _TABLE_LINE.match(line)
+                if match:
+                    line = self._correct_table_name(line, match.group(1), table_set, available_tables, table_warnings)
             
+            # Time filters: ago(7) / ago(7 days) -> ago(7d) etc.
+            line, replacements = _AGO_PATTERN.subn(_normalize_ago, line)
+            time_format_fixed = time_format_fixed or bool(replacements)
+            
+            line_lower = line.lower()
+            if 'TimeGenerated' in line or 'ago(' in line_lower:
+                has_time_filter = True
+            
+            # Operators and functions
+            operators.update(' '.join(m.group(1).lower().split()) for m in _OP_RE.finditer(line))
+            funcs_present.update(_FUNC_CALL_RE.findall(line_lower))
+            if 'summarize' in line_lower:
+                has_summarize = True
+            elif has_summarize and 'project' in line_lower:
+                project_after_summarize = True
+            
+            # Common mistakes: function names, then string comparison operators
+            for wrong, correct, pattern in _FUNCTION_FIXES:
+                line, replacements = pattern.subn(correct, line)
+                if replacements:
+                    fixed_functions.add(wrong)
+            line, replacements = _STRING_ASSIGNMENT.subn(r'\1 == \2', line)
+            assignment_fixed = assignment_fixed or bool(replacements)
+            
+            if first_line is None and not line.startswith('//'):
+                first_line = line
+            paren_balance += line.count('(') - line.count(')')
             corrected_lines.append(line)
         
-        corrected = '\n'.join(corrected_lines)
-        
-        return corrected, warnings
+        corrected_query = '\n'.join(corrected_lines)
+        
+        if time_format_fixed:
+            time_warnings.append("Corrected time filter format")
+        if not has_time_filter:
+            time_warnings.append("Consider adding a TimeGenerated filter for better performance")
+        
+        if operators['order by'] and operators['sort by']:
+            operator_warnings.append("Use either 'order by' or 'sort by', not both")
+        if operators['take'] and operators['limit']:
+            operator_warnings.append("Use either 'take' or 'limit', not both")
+        if operators['summarize'] and not funcs_present & _AGGREGATION_FUNCTIONS:
+            operator_warnings.append("Summarize statement should include aggregation functions")
+        if project_after_summarize:
+            operator_warnings.append("Project after summarize may not work as expected; consider using extend instead")
+        
+        for wrong, correct, _ in _FUNCTION_FIXES:
+            if wrong in fixed_functions:
+                mistake_warnings.append(f"Corrected function name: {wrong} -> {correct}")
+        if assignment_fixed:
+            mistake_warnings.append("Changed assignment operator (=) to comparison operator (==) for string comparison")
+        
+        # Final validation: the first non-comment line should be a table name,
+        # union or let, and parentheses must balance
+        is_valid = (
+            first_line is not None
+            and bool(_IDENTIFIER_START.match(first_line)
+                     or first_line.lower().startswith('union')
+                     or first_line.lower().startswith('let'))
+            and paren_balance == 0
+        )
+        
+        warnings = syntax_warnings + table_warnings + time_warnings + operator_warnings + mistake_warnings
+        return corrected_query, tuple(warnings), is_valid
     
-    def _check_table_names(self, query: str, available_tables: List[str] = None) -> Tuple[str, List[str]]:
-        """Check and correct table names"""
-        warnings = []
-        corrected = query
-        
-        # Extract table names from the query
-        table_pattern = r'^([A-Za-z][A-Za-z0-9_]*)\s*(?:\||$)'
-        lines = corrected.split('\n')
+    def _remove_markdown(self, query: str) -> str:
+        """Remove markdown code block formatting"""
+        # Remove ```kusto or ```kql blocks
+        query = strip_fences(query)
         
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line or line.startswith('//') or line.startswith('|'):
-                continue
-                
-            match = re.match(table_pattern, line)
-            if match:
-                table_name = match.group(1)
-                
-                # Check if table name is valid
-                if available_tables:
-                    # Use provided table list
-                    if table_name not in available_tables:
-                        # Try to find a close match
-                        close_match = self._find_closest_table(table_name, available_tables)
-                        if close_match:
-                            corrected = corrected.replace(table_name, close_match, 1)
-                            warnings.append(f"Corrected table name '{table_name}' to '{close_match}'")
-                        else:
-                            warnings.append(f"Table '{table_name}' not found in workspace")
-                else:
-                    # Use common table names
-                    if table_name not in self.common_tables:
-                        close_match = self._find_closest_table(table_name, list(self.common_tables))
-                        if close_match:
-                            corrected = corrected.replace(table_name, close_match, 1)
-                            warnings.append(f"Suggested table name correction: '{table_name}' -> '{close_match}'")
+        # Remove inline code backticks
+        query = _INLINE_TICK.sub(r'\1', query)
         
-        return corrected, warnings
+        return query.strip()
+    
+    def _correct_table_name(self, line: str, table_name: str, table_set: Optional[set],
+                            available_tables: Tuple[str, ...], warnings: List[str]) -> str:
+        """Check the table name that starts a line and correct it if it is unknown"""
+        if table_set is not None:
+            # Use provided table list
+            if table_name not in table_set:
+                # Try to find a close match
+                close_match = self._find_closest_table(table_name, available_tables)
+                if close_match:
+                    warnings.append(f"Corrected table name '{table_name}' to '{close_match}'")
+                    return line.replace(table_name, close_match, 1)
+                warnings.append(f"Table '{table_name}' not found in workspace")
+        elif table_name not in self.common_tables:
+            # Use common table names
+            close_match = self._find_closest_table(table_name, list(self.common_tables))
+            if close_match:
+                warnings.append(f"Suggested table name correction: '{table_name}' -> '{close_match}'")
+                return line.replace(table_name, close_match, 1)
+        return line
     
     def _find_closest_table(self, table_name: str, available_tables: List[str]) -> Optional[str]:
         """Find the closest matching table name"""
@@ -172,173 +282,46 @@ class KQLValidator:
             if table_lower in table.lower() or table.lower() in table_lower:
                 return table
         
-        # Levenshtein distance (simple version)
-        min_distance = float('inf')
+        # Levenshtein distance, allowing up to 2 character differences
+        if process is not None:
+            # Scored in C over the whole candidate list
+            match = process.extractOne(
+                table_lower, available_tables,
+                scorer=Levenshtein.distance,
+                processor=str.lower,
+                score_cutoff=2
+            )
+            return match[0] if match else None
+        
+        min_distance = 3
         closest_table = None
-        
         for table in available_tables:
-            distance = self._levenshtein_distance(table_lower, table.lower())
-            if distance < min_distance and distance <= 2:  # Allow up to 2 character differences
+            distance = _lev_le(table_lower, table.lower(), 2)
+            if distance < min_distance:
                 min_distance = distance
                 closest_table = table
         
         return closest_table
     
-    def _levenshtein_distance(self, s1: str, s2: str) -> int:
-        """Calculate Levenshtein distance between two strings"""
-        if len(s1) < len(s2):
-            return self._levenshtein_distance(s2, s1)
-        
-        if len(s2) == 0:
-            return len(s1)
-        
-        previous_row = list(range(len(s2) + 1))
-        for i, c1 in enumerate(s1):
-            current_row = [i + 1]
-            for j, c2 in enumerate(s2):
-                insertions = previous_row[j + 1] + 1
-                deletions = current_row[j] + 1
-                substitutions = previous_row[j] + (c1 != c2)
-                current_row.append(min(insertions, deletions, substitutions))
-            previous_row = current_row
-        
-        return previous_row[-1]
-    
-    def _check_time_filters(self, query: str) -> Tuple[str, List[str]]:
-        """Check and correct time filters"""
-        warnings = []
-        corrected = query
-        
-        # Check for common time filter patterns
-        time_patterns = [
-            (r'ago\s*\(\s*(\d+)\s*\)', r'ago(\1d)'),  # ago(7) -> ago(7d)
-            (r'ago\s*\(\s*(\d+)\s*days?\s*\)', r'ago(\1d)'),  # ago(7 days) -> ago(7d)
-            (r'ago\s*\(\s*(\d+)\s*hours?\s*\)', r'ago(\1h)'),  # ago(24 hours) -> ago(24h)
-            (r'ago\s*\(\s*(\d+)\s*minutes?\s*\)', r'ago(\1m)'),  # ago(30 minutes) -> ago(30m)
-        ]
-        
-        for pattern, replacement in time_patterns:
-            if re.search(pattern, corrected, re.IGNORECASE):
-                corrected = re.sub(pattern, replacement, corrected, flags=re.IGNORECASE)
-                warnings.append("Corrected time filter format")
-        
-        # Check for missing TimeGenerated filter
-        if 'TimeGenerated' not in corrected and 'ago(' not in corrected.lower():
-            warnings.append("Consider adding a TimeGenerated filter for better performance")
-        
-        return corrected, warnings
-    
-    def _check_operators_and_functions(self, query: str) -> List[str]:
-        """Check operators and functions usage"""
-        warnings = []
-        query_lower = query.lower()
-        
-        # Check for common operator mistakes
-        if 'order by' in query_lower and 'sort by' in query_lower:
-            warnings.append("Use either 'order by' or 'sort by', not both")
-        
-        if 'take' in query_lower and 'limit' in query_lower:
-            warnings.append("Use either 'take' or 'limit', not both")
-        
-        # Check for missing aggregation in summarize
-        if 'summarize' in query_lower:
-            if not any(func in query_lower for func in ['count()', 'sum(', 'avg(', 'min(', 'max(', 'dcount(']):
-                warnings.append("Summarize statement should include aggregation functions")
-        
-        # Check for project after summarize
-        lines = query.split('\n')
-        has_summarize = False
-        for line in lines:
-            line_lower = line.lower().strip()
-            if 'summarize' in line_lower:
-                has_summarize = True
-            elif has_summarize and 'project' in line_lower:
-                warnings.append("Project after summarize may not work as expected; consider using extend instead")
-                break
-        
-        return warnings
-    
-    def _fix_common_mistakes(self, query: str) -> Tuple[str, List[str]]:
-        """Fix common KQL mistakes"""
-        warnings = []
-        corrected = query
-        
-        # Fix common function name mistakes
-        function_fixes = {
-            'length(': 'strlen(',
-            'len(': 'strlen(',
-            'substring(': 'substr(',
-            'isnull(': 'isempty(',
-            'notnull(': 'isnotempty(',
-        }
-        
-        for wrong, correct in function_fixes.items():
-            if wrong in corrected.lower():
-                corrected = re.sub(re.escape(wrong), correct, corrected, flags=re.IGNORECASE)
-                warnings.append(f"Corrected function name: {wrong} -> {correct}")
-        
-        # Fix common operator mistakes
-        operator_fixes = {
-            ' = ': ' == ',  # Assignment vs comparison
-            'and ': 'and ',  # Ensure proper spacing
-            'or ': 'or ',
-        }
-        
-        # Fix string comparison operators
-        if re.search(r'\w+\s*=\s*"[^"]*"', corrected):
-            corrected = re.sub(r'(\w+)\s*=\s*("[^"]*")', r'\1 == \2', corrected)
-            warnings.append("Changed assignment operator (=) to comparison operator (==) for string comparison")
-        
-        return corrected, warnings
-    
-    def _final_validation(self, query: str) -> bool:
-        """Perform final validation checks"""
-        # Check for basic structure
-        if not query.strip():
-            return False
-        
-        # Check for at least one table reference
-        lines = [line.strip() for line in query.split('\n') if line.strip()]
-        if not lines:
-            return False
-        
-        # First non-comment line should be a table name or union
-        first_line = None
-        for line in lines:
-            if not line.startswith('//'):
-                first_line = line
-                break
-        
-        if not first_line:
-            return False
-        
-        # Check if first line looks like a table name or valid KQL start
-        if not (re.match(r'^[A-Za-z][A-Za-z0-9_]*', first_line) or 
-                first_line.lower().startswith('union') or
-                first_line.lower().startswith('let')):
-            return False
-        
-        # Check for balanced parentheses
-        open_parens = query.count('(')
-        close_parens = query.count(')')
-        if open_parens != close_parens:
-            return False
-        
-        return True
-    
     def get_query_complexity_score(self, query: str) -> Dict[str, Any]:
         """Analyze query complexity and provide metrics"""
+        analysis = self._complexity_cached(query)
+        # Callers get their own copy since the cached dict is shared
+        return {**analysis, "operations": dict(analysis["operations"])}
+    
+    def _complexity_score(self, query: str) -> Dict[str, Any]:
         query_lower = query.lower()
         
         # Count different types of operations
+        counts = _count_operators(query)
         operations = {
-            'filters': query_lower.count('where'),
-            'projections': query_lower.count('project'),
-            'aggregations': query_lower.count('summarize'),
-            'joins': query_lower.count('join'),
-            'unions': query_lower.count('union'),
-            'sorts': query_lower.count('order by') + query_lower.count('sort by'),
-            'limits': query_lower.count('take') + query_lower.count('limit'),
+            'filters': counts['where'],
+            'projections': counts['project'],
+            'aggregations': counts['summarize'],
+            'joins': counts['join'],
+            'unions': counts['union'],
+            'sorts': counts['order by'] + counts['sort by'],
+            'limits': counts['take'] + counts['limit'],
         }
         
         # Calculate complexity score
@@ -355,6 +338,9 @@ class KQLValidator:
             "operations": operations,
             "complexity_score": complexity_score,
             "performance_impact": performance_impact,
-            "line_count": len([line for line in query.split('\n') if line.strip()]),
+            "line_count": sum(1 for line in query.split('\n') if line.strip()),
             "has_time_filter": 'ago(' in query_lower or 'timegenerated' in query_lower
-        } 
\ No newline at end of file
+        } 
+
+# Global instance
+validator = KQLValidator()
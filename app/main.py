@@ -1,21 +1,33 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from .schemas import NL2KQLRequest, NL2KQLResponse, ExecuteRequest, ExecuteResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Response
+from .schemas import (
+    NL2KQLRequest, NL2KQLResponse, ExecuteRequest, ExecuteResponse, RAGStatusResponse,
+    BatchSubmitResponse, BatchStatusResponse
+)
 from .nlp2kql import nl_to_kql, nl_to_kql_detailed
 from .kql_executor import execute_kql
+from .azure_clients import close_azure_clients
 from .multi_rag_workflow import multi_rag_workflow
+from .azure_openai_client import close_http_client
+from .aoai_batch import submit_batch, get_batch_results
+from .aoai_pool import run_many
+from .metrics import render_metrics
+from .config import settings
+from typing import List
 import logging
 import asyncio
+import os
 
 # Configure basic logging to output to console if not already configured elsewhere
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="NL2KQL API with Multi-RAG Workflow", version="2.0.0")
 
 @app.post("/nl2kql", response_model=NL2KQLResponse)
-def convert_nl_to_kql(request: NL2KQLRequest):
+async def convert_nl_to_kql(request: NL2KQLRequest):
     """Convert natural language to KQL using the multi-RAG workflow"""
     try:
-        kql = nl_to_kql(
+        kql = await nl_to_kql(
             natural_language=request.natural_language, 
             context=request.context,
             workspace_id=request.workspace_id,
@@ -26,10 +38,10 @@ def convert_nl_to_kql(request: NL2KQLRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/nl2kql/detailed")
-def convert_nl_to_kql_detailed(request: NL2KQLRequest):
+async def convert_nl_to_kql_detailed(request: NL2KQLRequest):
     """Convert natural language to KQL with detailed generation information"""
     try:
-        result = nl_to_kql_detailed(
+        result = await nl_to_kql_detailed(
             natural_language=request.natural_language,
             context=request.context,
             workspace_id=request.workspace_id,
@@ -39,14 +51,47 @@ def convert_nl_to_kql_detailed(request: NL2KQLRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/nl2kql/batch", response_model=BatchSubmitResponse)
+async def submit_nl_to_kql_batch(batch_requests: List[NL2KQLRequest]):
+    """Submit many NL prompts as one Azure OpenAI batch job (basic generation, results within 24h)"""
+    if not batch_requests:
+        raise HTTPException(status_code=400, detail="At least one request is required")
+    try:
+        batch = await submit_batch([
+            {"natural_language": r.natural_language, "context": r.context} for r in batch_requests
+        ])
+        return BatchSubmitResponse(batch_id=batch["id"], status=batch.get("status", "validating"))
+    except Exception as e:
+        logger.error("Failed to submit batch: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/nl2kql/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_nl_to_kql_batch(batch_id: str):
+    """Get the status of a batch job and its generated KQL once completed"""
+    try:
+        return await get_batch_results(batch_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/nl2kql/parallel", response_model=List[NL2KQLResponse])
+async def convert_nl_to_kql_parallel(batch_requests: List[NL2KQLRequest]):
+    """Convert many NL prompts concurrently (basic generation) within the deployment's rate limits"""
+    try:
+        kql_queries = await run_many([
+            {"natural_language": r.natural_language, "context": r.context} for r in batch_requests
+        ])
+        return [NL2KQLResponse(kql_query=kql) for kql in kql_queries]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/execute", response_model=ExecuteResponse)
-def convert_and_execute(request: ExecuteRequest):
+async def convert_and_execute(request: ExecuteRequest):
     """Convert natural language to KQL and execute the query"""
     try:
-        logging.info(f"Received /execute request: {request.model_dump()}")
+        logger.info("Received /execute request: %s", request)
         
         # Generate KQL with detailed information
-        kql_result = nl_to_kql_detailed(
+        kql_result = await nl_to_kql_detailed(
             natural_language=request.natural_language,
             context=request.context,
             workspace_id=request.workspace_id,
@@ -54,12 +99,12 @@ def convert_and_execute(request: ExecuteRequest):
         )
         
         kql = kql_result['kql_query']
-        logging.info(f"Generated KQL: {kql}")
+        logger.info("Generated KQL: %s", kql)
         
         # Execute the query
-        data = execute_kql(kql, 
-                          workspace_id=request.workspace_id, 
-                          timespan_days=request.timespan_days)
+        data = await execute_kql(kql,
+                                 workspace_id=request.workspace_id,
+                                 timespan_days=request.timespan_days)
         
         # Enhanced response with generation details
         response_data = {
@@ -77,17 +122,17 @@ def convert_and_execute(request: ExecuteRequest):
         return ExecuteResponse(**response_data)
         
     except ValueError as ve:
-        logging.error(f"ValueError in /execute: {ve}")
+        logger.error("ValueError in /execute: %s", ve)
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        logging.error(f"Unhandled exception in /execute: {e}", exc_info=True)
+        logger.error("Unhandled exception in /execute: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/initialize-rag")
 async def initialize_rag_workflow(workspace_id: str, force_refresh: bool = False):
     """Initialize the multi-RAG workflow for a specific workspace"""
     try:
-        logging.info(f"Initializing RAG workflow for workspace: {workspace_id}")
+        logger.info("Initializing RAG workflow for workspace: %s", workspace_id)
         await multi_rag_workflow.initialize_workflow(workspace_id, force_refresh)
         
         status = multi_rag_workflow.get_workflow_status()
@@ -97,10 +142,10 @@ async def initialize_rag_workflow(workspace_id: str, force_refresh: bool = False
             "status": status
         }
     except Exception as e:
-        logging.error(f"Failed to initialize RAG workflow: {e}")
+        logger.error("Failed to initialize RAG workflow: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to initialize RAG workflow: {str(e)}")
 
-@app.get("/rag-status")
+@app.get("/rag-status", response_model=RAGStatusResponse)
 def get_rag_status():
     """Get the current status of the multi-RAG workflow"""
     try:
@@ -116,7 +161,7 @@ def add_feedback(natural_language: str, generated_kql: str, user_feedback: str,
         multi_rag_workflow.add_feedback(natural_language, generated_kql, user_feedback, corrected_kql)
         return {"message": "Feedback added successfully"}
     except Exception as e:
-        logging.error(f"Failed to add feedback: {e}")
+        logger.error("Failed to add feedback: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
@@ -133,13 +178,51 @@ def health_check():
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint with per-stage multi-RAG latency histograms"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="prometheus_client is not installed")
+    content, content_type = rendered
+    return Response(content=content, media_type=content_type)
+
 # Background task to initialize RAG workflow on startup
 @app.on_event("startup")
 async def startup_event():
     """Initialize the application on startup"""
-    logging.info("NL2KQL API with Multi-RAG Workflow starting up...")
+    logger.info("NL2KQL API with Multi-RAG Workflow starting up...")
     
     # Note: We don't auto-initialize the RAG workflow here because it requires a workspace_id
     # Users should call /initialize-rag endpoint with their workspace_id
     
-    logging.info("Application startup completed. Use /initialize-rag to set up the RAG workflow.") 
\ No newline at end of file
+    # With a default workspace configured, warm the schema cache in the background so
+    # /initialize-rag does not wait on table discovery
+    if settings.log_analytics_workspace_id:
+        app.state.schema_prewarm = asyncio.create_task(
+            multi_rag_workflow.schema_generator.prewarm(settings.log_analytics_workspace_id)
+        )
+    
+    logger.info("Application startup completed. Use /initialize-rag to set up the RAG workflow.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections on shutdown"""
+    await close_http_client()
+    await close_azure_clients()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop and httptools cut per-request event-loop and HTTP parsing overhead.
+    # A single worker by default: the RAG initialization state, embedder, result caches and
+    # metrics live in the process, and Chroma's persist directory must not be shared between
+    # processes. WEB_CONCURRENCY overrides this only when set explicitly.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1))
+    )
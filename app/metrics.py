@@ -0,0 +1,29 @@
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+try:
+    from prometheus_client import Histogram, CONTENT_TYPE_LATEST, generate_latest
+except ImportError:  # Stage timing is optional; without prometheus_client it is a no-op
+    Histogram = None
+
+# Per-stage latency of the multi-RAG workflow: retrieve, refine, generate, validate
+RAG_STAGE_SECONDS = Histogram(
+    "nl2kql_rag_stage_seconds",
+    "Time spent in each multi-RAG workflow stage",
+    ["stage"]
+) if Histogram is not None else None
+
+@contextmanager
+def time_stage(stage: str):
+    """Record how long the enclosed block takes under the given stage label"""
+    if RAG_STAGE_SECONDS is None:
+        yield
+        return
+    with RAG_STAGE_SECONDS.labels(stage).time():
+        yield
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """Metrics in the Prometheus text format with its content type, or None if prometheus_client is missing"""
+    if Histogram is None:
+        return None
+    return generate_latest(), CONTENT_TYPE_LATEST
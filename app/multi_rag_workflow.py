@@ -1,28 +1,89 @@
 from typing import List, Dict, Any, Optional
 import logging
 import asyncio
+import copy
+import hashlib
+import json
+import time
+from pathlib import Path
+import numpy as np
 from .vector_store import VectorStore
 from .schema_generator import SchemaGenerator
 from .schema_refiner import SchemaRefiner
-from .kql_validator import KQLValidator
-from .azure_openai_client import get_kql_from_nl
-import requests
+from .kql_validator import validator
+from .azure_openai_client import get_kql_from_nl, stream_completion_with_retry, encode_json, AOAI_URL, AOAI_HEADERS, AOAI_MODEL
+from .kql_text import strip_fences
+from .semantic_cache import semantic_cache
+from .metrics import time_stage
+from .cache import TTLCache
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+# Built-in NL2KQL examples seeded into the ground truth collection
+_GT_EXAMPLES = (
+    {
+        "natural_language": "Show me all security events from the last 24 hours",
+        "kql_query": "SecurityEvent\n| where TimeGenerated > ago(24h)\n| take 100",
+        "description": "Basic security event query with time filter"
+    },
+    {
+        "natural_language": "Count failed login attempts by user",
+        "kql_query": "SecurityEvent\n| where TimeGenerated > ago(7d)\n| where EventID == 4625\n| summarize FailedLogins = count() by Account\n| order by FailedLogins desc",
+        "description": "Aggregation query for failed login analysis"
+    },
+    {
+        "natural_language": "Show Azure activity logs for resource creation",
+        "kql_query": "AzureActivity\n| where TimeGenerated > ago(1d)\n| where OperationName contains \"Create\"\n| project TimeGenerated, Caller, OperationName, ResourceGroup, Resource",
+        "description": "Azure activity filtering and projection"
+    },
+    {
+        "natural_language": "Find processes with high CPU usage",
+        "kql_query": "Perf\n| where TimeGenerated > ago(1h)\n| where ObjectName == \"Processor\" and CounterName == \"% Processor Time\"\n| where CounterValue > 80\n| project TimeGenerated, Computer, CounterValue",
+        "description": "Performance monitoring query"
+    },
+    {
+        "natural_language": "Show recent sign-in failures",
+        "kql_query": "SigninLogs\n| where TimeGenerated > ago(24h)\n| where ResultType != \"0\"\n| project TimeGenerated, UserPrincipalName, AppDisplayName, ResultType, ResultDescription",
+        "description": "Sign-in log analysis for failures"
+    }
+)
+
+# Their embeddings only change with the examples or the embedding model, so they are kept on disk
+_GT_CACHE_DIR = Path.home() / ".cache" / "nl2kql"
+
+_RAG_SYSTEM_PROMPT = """You are an expert KQL (Kusto Query Language) assistant. Generate ONLY valid KQL queries based on the provided context and natural language request.
+
+Rules:
+1. Return ONLY the KQL query, no explanations or markdown
+2. Use only tables and fields mentioned in the context
+3. Always include TimeGenerated filters when appropriate
+4. Use proper KQL syntax and operators
+5. Ensure field names match exactly as provided in the context
+6. Prefer simple, efficient queries over complex ones"""
+
 class MultiRAGWorkflow:
     """Main orchestrator for the multi-RAG workflow for NL2KQL generation"""
     
     def __init__(self):
-        self.vector_store = VectorStore()
+        self.vector_store = VectorStore(half_precision=settings.embedder_half_precision)
         self.schema_generator = SchemaGenerator()
         self.schema_refiner = SchemaRefiner()
-        self.kql_validator = KQLValidator()
-        self._initialized = False
+        self.kql_validator = validator
+        # A snapshot persisted by an earlier process lets a fresh boot skip workspace discovery
+        self._initialized = self._has_fresh_snapshot()
+        # Full generation results for repeated prompts (retrieval + Azure OpenAI + validation)
+        self._result_cache = TTLCache(maxsize=1024, ttl_seconds=settings.rag_result_cache_ttl_seconds)
+        
+        # Share the already-loaded embedding model with the semantic cache
+        semantic_cache.attach_embedder(self.vector_store.embedder)
+        
+    async def initialize_workflow(self, workspace_id: str, force_refresh: bool = False, concurrency: int = 8):
+        """Initialize the workflow by populating vector stores with schema data
         
-    async def initialize_workflow(self, workspace_id: str, force_refresh: bool = False):
-        """Initialize the workflow by populating vector stores with schema data"""
+        Args:
+            concurrency: Maximum number of Log Analytics queries in flight while processing tables
+        """
         if self._initialized and not force_refresh:
             logger.info("Multi-RAG workflow already initialized")
             return
@@ -30,16 +91,18 @@ class MultiRAGWorkflow:
         logger.info("Initializing multi-RAG workflow...")
         
         try:
-            # Check if we already have data in vector stores
-            stats = self.vector_store.get_collection_stats()
-            if not force_refresh and all(count > 0 for count in stats.values()):
-                logger.info(f"Vector stores already populated: {stats}")
+            # Check if we already have data in vector stores for this workspace
+            if not force_refresh and self._has_fresh_snapshot(workspace_id):
+                logger.info(f"Vector stores already populated: {self.vector_store.get_collection_stats()}")
                 self._initialized = True
                 return
             
+            if force_refresh:
+                self.schema_generator.clear_schema_cache()
+            
             # Discover tables in the workspace
             logger.info("Discovering tables in workspace...")
-            tables = self.schema_generator.discover_tables(workspace_id)
+            tables = await self.schema_generator.discover_tables(workspace_id)
             logger.info(f"Found {len(tables)} tables: {tables[:10]}...")  # Log first 10
             
             # Process each table to extract schema and generate descriptions
@@ -50,154 +113,204 @@ class MultiRAGWorkflow:
             # Limit to top tables to avoid overwhelming the system
             tables_to_process = tables[:20]  # Process top 20 tables
             
-            for i, table_name in enumerate(tables_to_process):
-                logger.info(f"Processing table {i+1}/{len(tables_to_process)}: {table_name}")
-                
-                try:
-                    # Extract schema information
-                    schema_info = self.schema_generator.extract_table_schema(table_name, workspace_id)
-                    
-                    if not schema_info['columns']:
-                        logger.warning(f"No columns found for table {table_name}, skipping")
-                        continue
-                    
-                    # Generate field descriptions
-                    field_descriptions = self.schema_generator.generate_field_descriptions(schema_info)
-                    all_field_descriptions.extend(field_descriptions)
-                    
-                    # Extract field values for key fields
-                    for field_desc in field_descriptions[:10]:  # Limit to first 10 fields per table
-                        field_name = field_desc['field_name']
-                        sample_values = self.schema_generator.extract_field_values(
-                            table_name, field_name, workspace_id, limit=50
-                        )
-                        
-                        if sample_values:
-                            all_field_values.append({
-                                'table_name': table_name,
-                                'field_name': field_name,
-                                'sample_values': sample_values
-                            })
-                    
-                    # Generate table description
-                    table_description = self.schema_generator.generate_table_description(table_name, schema_info)
-                    
-                    # Create schema entry
-                    schema_entry = {
-                        'table_name': table_name,
-                        'description': table_description,
-                        'schema': self._format_schema(schema_info['columns'])
-                    }
-                    all_schemas.append(schema_entry)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing table {table_name}: {e}")
+            # Tables are processed concurrently; the semaphore bounds in-flight Log Analytics queries
+            log_analytics_slots = asyncio.Semaphore(concurrency)
+            results = await asyncio.gather(
+                *[self._process_table(table_name, workspace_id, log_analytics_slots) for table_name in tables_to_process],
+                return_exceptions=True
+            )
+            
+            for table_name, result in zip(tables_to_process, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error processing table {table_name}: {result}")
                     continue
+                if result is None:
+                    continue
+                
+                field_descriptions, field_values, schema_entry = result
+                all_field_descriptions.extend(field_descriptions)
+                all_field_values.extend(field_values)
+                all_schemas.append(schema_entry)
             
-            # Populate vector stores
+            # Populate vector stores from scratch, dropping whatever an earlier population left behind
             logger.info("Populating vector stores...")
+            await asyncio.to_thread(self.vector_store.reset_collections)
             
-            if all_field_descriptions:
-                self.vector_store.add_field_descriptions(all_field_descriptions)
-            
-            if all_field_values:
-                self.vector_store.add_field_values(all_field_values)
-            
-            if all_schemas:
-                self.vector_store.add_schemas(all_schemas)
+            # Embedding and the Chroma/SQLite writes block, so they run off the event loop
+            await asyncio.to_thread(self.vector_store.add_all, all_field_descriptions, all_field_values, all_schemas)
             
             # Add some ground truth examples
-            self._add_ground_truth_examples()
+            await asyncio.to_thread(self._add_ground_truth_examples)
             
             # Log final stats
             final_stats = self.vector_store.get_collection_stats()
             logger.info(f"Vector stores populated: {final_stats}")
             
+            await asyncio.to_thread(self.vector_store.save_manifest, workspace_id, tables_to_process)
             self._initialized = True
+            # Results generated against the previous vector store contents are stale now
+            self._result_cache.clear()
             logger.info("Multi-RAG workflow initialization completed")
             
         except Exception as e:
             logger.error(f"Failed to initialize multi-RAG workflow: {e}")
             raise
     
+    def _has_fresh_snapshot(self, workspace_id: str = None) -> bool:
+        """Whether the persisted vector stores are populated, recent, and built for this workspace and embedder"""
+        manifest = self.vector_store.load_manifest()
+        if manifest is None:
+            return False
+        if workspace_id is not None and manifest.get("workspace_id") != workspace_id:
+            return False
+        if manifest.get("embedder_id") != self.vector_store.embedder_id:
+            return False
+        if self.vector_store.collections_outdated:
+            return False
+        if time.time() - manifest.get("timestamp", 0) > settings.rag_snapshot_ttl_seconds:
+            return False
+        return all(count > 0 for count in self.vector_store.get_collection_stats().values())
+    
+    async def _process_table(self, table_name: str, workspace_id: str, log_analytics_slots: asyncio.Semaphore):
+        """Extract schema, field values and descriptions for one table
+        
+        Returns:
+            Tuple of (field_descriptions, field_values, schema_entry), or None if the table has no columns
+        """
+        logger.info(f"Processing table: {table_name}")
+        schema_generator = self.schema_generator
+        
+        # Extract schema information
+        async with log_analytics_slots:
+            schema_info = await schema_generator.extract_table_schema(table_name, workspace_id)
+        
+        if not schema_info['columns']:
+            logger.warning(f"No columns found for table {table_name}, skipping")
+            return None
+        
+        # Generate field descriptions (blocking Azure OpenAI calls, so run off the event loop)
+        field_descriptions = await asyncio.to_thread(schema_generator.generate_field_descriptions, schema_info)
+        
+        # Extract field values for key fields
+        async def extract_values(field_name: str):
+            async with log_analytics_slots:
+                return await schema_generator.extract_field_values(
+                    table_name, field_name, workspace_id, limit=50
+                )
+        
+        field_names = [field_desc.field_name for field_desc in field_descriptions[:10]]  # Limit to first 10 fields per table
+        table_description_task = asyncio.to_thread(
+            schema_generator.generate_table_description, table_name, schema_info
+        )
+        *sample_values_per_field, table_description = await asyncio.gather(
+            *[extract_values(field_name) for field_name in field_names],
+            table_description_task
+        )
+        
+        field_values = [
+            {
+                'table_name': table_name,
+                'field_name': field_name,
+                'sample_values': sample_values
+            }
+            for field_name, sample_values in zip(field_names, sample_values_per_field)
+            if sample_values
+        ]
+        
+        # Create schema entry
+        schema_entry = {
+            'table_name': table_name,
+            'description': table_description,
+            'schema': self._format_schema(schema_info['columns'])
+        }
+        
+        return field_descriptions, field_values, schema_entry
+    
     def _format_schema(self, columns: List[Dict[str, Any]]) -> str:
         """Format column information into a readable schema string"""
-        schema_parts = []
-        for col in columns:
-            schema_parts.append(f"{col['name']} ({col['type']})")
-        return ", ".join(schema_parts)
+        return ", ".join(f"{col['name']} ({col['type']})" for col in columns)
     
     def _add_ground_truth_examples(self):
         """Add some ground truth NL2KQL examples to the vector store"""
-        ground_truth_examples = [
-            {
-                "natural_language": "Show me all security events from the last 24 hours",
-                "kql_query": "SecurityEvent\n| where TimeGenerated > ago(24h)\n| take 100",
-                "description": "Basic security event query with time filter"
-            },
-            {
-                "natural_language": "Count failed login attempts by user",
-                "kql_query": "SecurityEvent\n| where TimeGenerated > ago(7d)\n| where EventID == 4625\n| summarize FailedLogins = count() by Account\n| order by FailedLogins desc",
-                "description": "Aggregation query for failed login analysis"
-            },
-            {
-                "natural_language": "Show Azure activity logs for resource creation",
-                "kql_query": "AzureActivity\n| where TimeGenerated > ago(1d)\n| where OperationName contains \"Create\"\n| project TimeGenerated, Caller, OperationName, ResourceGroup, Resource",
-                "description": "Azure activity filtering and projection"
-            },
-            {
-                "natural_language": "Find processes with high CPU usage",
-                "kql_query": "Perf\n| where TimeGenerated > ago(1h)\n| where ObjectName == \"Processor\" and CounterName == \"% Processor Time\"\n| where CounterValue > 80\n| project TimeGenerated, Computer, CounterValue",
-                "description": "Performance monitoring query"
-            },
-            {
-                "natural_language": "Show recent sign-in failures",
-                "kql_query": "SigninLogs\n| where TimeGenerated > ago(24h)\n| where ResultType != \"0\"\n| project TimeGenerated, UserPrincipalName, AppDisplayName, ResultType, ResultDescription",
-                "description": "Sign-in log analysis for failures"
-            }
-        ]
+        self.vector_store.add_ground_truth_pairs(list(_GT_EXAMPLES), embeddings=self._ground_truth_embeddings())
+    
+    def _ground_truth_embeddings(self) -> Optional[np.ndarray]:
+        """Load the built-in examples' embeddings from disk, encoding and saving them on a cache miss"""
+        embedder_id = self.vector_store.embedder_id
+        if embedder_id is None:
+            return None
         
-        self.vector_store.add_ground_truth_pairs(ground_truth_examples)
+        key = hashlib.md5(json.dumps([embedder_id, _GT_EXAMPLES]).encode("utf-8")).hexdigest()
+        cache_file = _GT_CACHE_DIR / f"gt_{key}.npy"
+        try:
+            if cache_file.exists():
+                return np.load(cache_file)
+            embeddings = self.vector_store.encode_documents([ex["natural_language"] for ex in _GT_EXAMPLES])
+            _GT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            np.save(cache_file, embeddings)
+            return embeddings
+        except Exception as e:
+            logger.warning(f"Ground truth embedding cache unavailable: {e}")
+            return None
     
-    def generate_kql_with_rag(self, natural_language: str, workspace_id: str = None, context: str = None) -> Dict[str, Any]:
+    async def generate_kql_with_rag(self, natural_language: str, workspace_id: str = None, context: str = None) -> Dict[str, Any]:
         """Generate KQL using the multi-RAG workflow"""
         
         # Ensure workflow is initialized
         if not self._initialized:
             logger.warning("Multi-RAG workflow not initialized, using basic generation")
-            return self._fallback_generation(natural_language, context)
+            return await self._fallback_generation(natural_language, context, workspace_id)
+        
+        # Prompts that differ only in whitespace share a cache entry; case is kept because
+        # literals in the prompt can end up in case-sensitive KQL comparisons
+        cache_key = (" ".join(natural_language.split()), context, workspace_id)
+        if self._result_cache.ttl_seconds > 0:
+            cached_result = self._result_cache.get(cache_key)
+            if cached_result is not None:
+                logger.info(f"Returning cached multi-RAG result for: {natural_language}")
+                return copy.deepcopy(cached_result)
         
         try:
             logger.info(f"Generating KQL with multi-RAG for: {natural_language}")
             
             # Step 1: Retrieve relevant context using similarity search
             logger.info("Step 1: Retrieving relevant context...")
-            relevant_fields = self.vector_store.search_relevant_fields(natural_language, n_results=15)
-            relevant_values = self.vector_store.search_relevant_values(natural_language, n_results=8)
-            relevant_schemas = self.vector_store.search_relevant_schemas(natural_language, n_results=5)
-            similar_queries = self.vector_store.search_similar_queries(natural_language, n_results=5)
+            with time_stage("retrieve"):
+                # Embed the question once and share the vector between the four searches
+                query_embedding = await asyncio.to_thread(self.vector_store.embed_query, natural_language)
+                
+                # The four searches are independent, so run them concurrently off the event loop
+                relevant_fields, relevant_values, relevant_schemas, similar_queries = await asyncio.gather(
+                    asyncio.to_thread(self.vector_store.search_relevant_fields_by_vector, query_embedding, n_results=15),
+                    asyncio.to_thread(self.vector_store.search_relevant_values_by_vector, query_embedding, n_results=8),
+                    asyncio.to_thread(self.vector_store.search_relevant_schemas_by_vector, query_embedding, n_results=5),
+                    asyncio.to_thread(self.vector_store.search_similar_queries_by_vector, query_embedding, n_results=5)
+                )
             
             logger.info(f"Retrieved: {len(relevant_fields)} fields, {len(relevant_values)} value sets, "
                        f"{len(relevant_schemas)} schemas, {len(similar_queries)} similar queries")
             
             # Step 2: Refine and process the retrieved context
             logger.info("Step 2: Refining context...")
-            refined_context = self.schema_refiner.refine_context(
-                natural_language, relevant_fields, relevant_values, relevant_schemas, similar_queries
-            )
+            with time_stage("refine"):
+                refined_context = self.schema_refiner.refine_context(
+                    natural_language, relevant_fields, relevant_values, relevant_schemas, similar_queries
+                )
+                enhanced_context = self._build_enhanced_context(refined_context, context)
             
             # Step 3: Generate KQL with enhanced context
             logger.info("Step 3: Generating KQL with enhanced context...")
-            enhanced_context = self._build_enhanced_context(refined_context, context)
-            kql_query = self._generate_kql_with_context(natural_language, enhanced_context)
+            with time_stage("generate"):
+                kql_query = await self._generate_kql_with_context(natural_language, enhanced_context)
             
             # Step 4: Validate and correct the generated KQL
             logger.info("Step 4: Validating and correcting KQL...")
-            available_tables = [table['table_name'] for table in refined_context['refined_tables']]
-            corrected_kql, warnings, is_valid = self.kql_validator.validate_and_correct(kql_query, available_tables)
-            
-            # Step 5: Get complexity analysis
-            complexity_analysis = self.kql_validator.get_query_complexity_score(corrected_kql)
+            with time_stage("validate"):
+                available_tables = [table.table_name for table in refined_context['refined_tables']]
+                corrected_kql, warnings, is_valid = self.kql_validator.validate_and_correct(kql_query, available_tables)
+                
+                # Step 5: Get complexity analysis
+                complexity_analysis = self.kql_validator.get_query_complexity_score(corrected_kql)
             
             result = {
                 "kql_query": corrected_kql,
@@ -215,12 +328,16 @@ class MultiRAGWorkflow:
             }
             
             logger.info(f"KQL generation completed. Valid: {is_valid}, Warnings: {len(warnings)}")
+            # Only successful RAG results are cached; fallbacks are retried on the next request
+            if self._result_cache.ttl_seconds > 0:
+                # The caller gets its own copy; warnings and complexity_analysis are mutable
+                self._result_cache.set(cache_key, copy.deepcopy(result))
             return result
             
         except Exception as e:
             logger.error(f"Error in multi-RAG workflow: {e}")
             # Fallback to basic generation
-            return self._fallback_generation(natural_language, context)
+            return await self._fallback_generation(natural_language, context, workspace_id)
     
     def _build_enhanced_context(self, refined_context: Dict[str, Any], original_context: str = None) -> str:
         """Build enhanced context string for KQL generation"""
@@ -237,51 +354,43 @@ class MultiRAGWorkflow:
         if refined_context['refined_tables']:
             context_parts.append("\nDetailed Table Information:")
             for table in refined_context['refined_tables'][:3]:  # Top 3 tables
-                table_info = f"\nTable: {table['table_name']}"
-                if table['description']:
-                    table_info += f"\nDescription: {table['description']}"
+                table_parts = [f"\nTable: {table.table_name}"]
+                if table.description:
+                    table_parts.append(f"\nDescription: {table.description}")
                 
                 # Add field information
-                if table['fields']:
-                    field_info = []
-                    for field in table['fields'][:8]:  # Top 8 fields
-                        field_desc = f"  - {field['field_name']} ({field['data_type']}): {field['description']}"
-                        field_info.append(field_desc)
-                    table_info += f"\nKey Fields:\n" + "\n".join(field_info)
+                fields = table.fields[:8]  # Top 8 fields
+                if fields:
+                    table_parts.append("\nKey Fields:\n")
+                    table_parts.append("\n".join(
+                        f"  - {field.field_name} ({field.data_type}): {field.description}"
+                        for field in fields
+                    ))
                 
                 # Add sample values
-                if table['sample_values']:
-                    values_info = []
-                    for value_info in table['sample_values'][:3]:  # Top 3 fields with values
-                        sample_vals = ", ".join(str(v) for v in value_info['sample_values'][:5])
-                        values_info.append(f"  - {value_info['field_name']}: {sample_vals}")
-                    table_info += f"\nSample Values:\n" + "\n".join(values_info)
+                value_sets = table.sample_values[:3]  # Top 3 fields with values
+                if value_sets:
+                    table_parts.append("\nSample Values:\n")
+                    table_parts.append("\n".join(
+                        f"  - {value_info.field_name}: " + ", ".join(str(v) for v in value_info.sample_values[:5])
+                        for value_info in value_sets
+                    ))
                 
-                context_parts.append(table_info)
+                context_parts.append("".join(table_parts))
         
         # Add similar query patterns
         if refined_context['query_patterns']:
             context_parts.append("\nSimilar Query Examples:")
             for pattern in refined_context['query_patterns'][:2]:  # Top 2 patterns
-                if pattern['kql_query']:
-                    context_parts.append(f"Example: {pattern['similar_nl']}")
-                    context_parts.append(f"KQL: {pattern['kql_query']}")
+                if pattern.kql_query:
+                    context_parts.append(f"Example: {pattern.similar_nl}")
+                    context_parts.append(f"KQL: {pattern.kql_query}")
         
         return "\n".join(context_parts)
     
-    def _generate_kql_with_context(self, natural_language: str, enhanced_context: str) -> str:
+    async def _generate_kql_with_context(self, natural_language: str, enhanced_context: str) -> str:
         """Generate KQL using Azure OpenAI with enhanced context"""
         try:
-            system_prompt = """You are an expert KQL (Kusto Query Language) assistant. Generate ONLY valid KQL queries based on the provided context and natural language request.
-
-Rules:
-1. Return ONLY the KQL query, no explanations or markdown
-2. Use only tables and fields mentioned in the context
-3. Always include TimeGenerated filters when appropriate
-4. Use proper KQL syntax and operators
-5. Ensure field names match exactly as provided in the context
-6. Prefer simple, efficient queries over complex ones"""
-
             user_prompt = f"""Natural Language Request: {natural_language}
 
 Context Information:
@@ -289,56 +398,34 @@ Context Information:
 
 Generate a valid KQL query that answers the request using the provided context."""
 
-            headers = {
-                "Authorization": f"Bearer {settings.azure_openai_key}",
-                "Content-Type": "application/json"
-            }
-            
             data = {
                 "messages": [
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _RAG_SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
                 ],
                 "temperature": 0.1,  # Low temperature for more deterministic results
                 "max_tokens": 500,
-                "model": "gpt-4.1-2025-04-14"
+                "model": AOAI_MODEL,
+                "stream": True
             }
             
-            response = requests.post(
-                f"{settings.azure_openai_endpoint}/openai/deployments/gpt-4.1-2025-04-14/chat/completions?api-version=2024-12-01-preview",
-                headers=headers,
-                json=data
-            )
+            # Streamed over the shared keep-alive client, stopping as soon as the query is complete
+            kql = await stream_completion_with_retry(AOAI_URL, headers=AOAI_HEADERS, content=encode_json(data))
             
-            if response.status_code == 200:
-                kql = response.json()["choices"][0]["message"]["content"].strip()
-                
-                # Clean up the response
-                if kql.startswith("```kusto"):
-                    kql = kql[len("```kusto"):].strip()
-                if kql.startswith("```kql"):
-                    kql = kql[len("```kql"):].strip()
-                if kql.startswith("```"):
-                    kql = kql[len("```"):].strip()
-                if kql.endswith("```"):
-                    kql = kql[:-len("```")].strip()
-                
-                return kql
-            else:
-                logger.error(f"Azure OpenAI API error: {response.status_code} - {response.text}")
-                raise Exception(f"Azure OpenAI API error: {response.status_code}")
+            # Clean up the response
+            return strip_fences(kql)
                 
         except Exception as e:
             logger.error(f"Error generating KQL with context: {e}")
             # Fallback to basic generation
-            return get_kql_from_nl(natural_language, enhanced_context)
+            return await get_kql_from_nl(natural_language, enhanced_context)
     
-    def _fallback_generation(self, natural_language: str, context: str = None) -> Dict[str, Any]:
+    async def _fallback_generation(self, natural_language: str, context: str = None, workspace_id: str = None) -> Dict[str, Any]:
         """Fallback to basic KQL generation when RAG workflow fails"""
         logger.info("Using fallback KQL generation")
         
         try:
-            kql_query = get_kql_from_nl(natural_language, context)
+            kql_query = await get_kql_from_nl(natural_language, context, workspace_id=workspace_id)
             corrected_kql, warnings, is_valid = self.kql_validator.validate_and_correct(kql_query)
             complexity_analysis = self.kql_validator.get_query_complexity_score(corrected_kql)
             
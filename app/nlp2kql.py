@@ -1,10 +1,11 @@
 from .multi_rag_workflow import multi_rag_workflow
 from .azure_openai_client import get_kql_from_nl
+from .kql_validator import validator
 import logging
 
 logger = logging.getLogger(__name__)
 
-def nl_to_kql(natural_language: str, context: str = None, workspace_id: str = None, use_rag: bool = True) -> str:
+async def nl_to_kql(natural_language: str, context: str = None, workspace_id: str = None, use_rag: bool = True) -> str:
     """
     Convert natural language to KQL using either the multi-RAG workflow or basic generation
     
@@ -20,7 +21,7 @@ def nl_to_kql(natural_language: str, context: str = None, workspace_id: str = No
     try:
         if use_rag:
             # Use the multi-RAG workflow
-            result = multi_rag_workflow.generate_kql_with_rag(
+            result = await multi_rag_workflow.generate_kql_with_rag(
                 natural_language=natural_language,
                 workspace_id=workspace_id,
                 context=context
@@ -28,14 +29,14 @@ def nl_to_kql(natural_language: str, context: str = None, workspace_id: str = No
             return result['kql_query']
         else:
             # Use basic generation
-            return get_kql_from_nl(natural_language, context)
+            return await get_kql_from_nl(natural_language, context, workspace_id=workspace_id)
             
     except Exception as e:
         logger.error(f"Error in nl_to_kql: {e}")
         # Fallback to basic generation
-        return get_kql_from_nl(natural_language, context)
+        return await get_kql_from_nl(natural_language, context, workspace_id=workspace_id)
 
-def nl_to_kql_detailed(natural_language: str, context: str = None, workspace_id: str = None, use_rag: bool = True) -> dict:
+async def nl_to_kql_detailed(natural_language: str, context: str = None, workspace_id: str = None, use_rag: bool = True) -> dict:
     """
     Convert natural language to KQL with detailed information about the generation process
     
@@ -51,17 +52,14 @@ def nl_to_kql_detailed(natural_language: str, context: str = None, workspace_id:
     try:
         if use_rag:
             # Use the multi-RAG workflow
-            return multi_rag_workflow.generate_kql_with_rag(
+            return await multi_rag_workflow.generate_kql_with_rag(
                 natural_language=natural_language,
                 workspace_id=workspace_id,
                 context=context
             )
         else:
             # Use basic generation with validation
-            from .kql_validator import KQLValidator
-            validator = KQLValidator()
-            
-            kql_query = get_kql_from_nl(natural_language, context)
+            kql_query = await get_kql_from_nl(natural_language, context, workspace_id=workspace_id)
             corrected_kql, warnings, is_valid = validator.validate_and_correct(kql_query)
             complexity_analysis = validator.get_query_complexity_score(corrected_kql)
             
@@ -1,15 +1,72 @@
 import re
 import json
-from typing import List, Dict, Any, Optional, Set
+import hashlib
+import asyncio
+import time
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Awaitable
 from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import zip_longest
+from pathlib import Path
 import logging
-from .azure_openai_client import get_kql_from_nl
-from .kql_executor import execute_kql
-import requests
+from .azure_openai_client import post_with_retry_sync, encode_json, AOAI_URL, AOAI_HEADERS, AOAI_MODEL
+from .kql_executor import execute_kql, execute_kql_batch
+from .cache import DiskCache
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+# Fields described per chat completion; keeps the JSON answer well under the completion token limit
+_DESCRIPTION_BATCH_SIZE = 20
+# Budget of description requests in flight, shared by every table being processed
+_description_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="schema-descriptions")
+
+# Static instructions for description requests. Keeping everything that does not vary in the
+# system message leaves a short JSON user message and an identical prefix on every call.
+_FIELD_DESCRIPTION_SYSTEM_PROMPT = (
+    "You are a log analytics expert. The user sends a JSON object with a Log Analytics table name and "
+    "a list of its fields, each with a name, data type and sample values. For each field write a concise, "
+    "technical 1-2 sentence description of what it represents and how it is used in KQL queries for log "
+    "analysis. Respond with a JSON object mapping each field name to its description."
+)
+_TABLE_DESCRIPTION_SYSTEM_PROMPT = (
+    "You are a log analytics expert. The user sends a JSON object with a Log Analytics table name and its "
+    "key columns. Reply with a concise 2-3 sentence description of what the table contains, what types of "
+    "events or data it stores, and its primary use cases in log analytics and KQL queries."
+)
+
+# Generated descriptions are reused across runs; bump the version when the prompts change
+_DESCRIPTION_CACHE_VERSION = "v2"
+_description_cache = DiskCache(Path.home() / ".cache" / "nl2kql" / "descriptions.sqlite")
+# Discovered tables and extracted schemas, as JSON entries stamped with the time they were saved
+_schema_cache = DiskCache(Path.home() / ".cache" / "nl2kql" / "schemas.sqlite")
+
+def _description_key(*parts: str) -> str:
+    return hashlib.blake2b("|".join((_DESCRIPTION_CACHE_VERSION,) + parts).encode("utf-8"), digest_size=16).hexdigest()
+
+# Substring patterns on the lowercased field name, in priority order, and the fallback description for each
+_FALLBACK_DESCRIPTIONS = tuple((re.compile(pattern), template) for pattern, template in (
+    ("time|date", "Timestamp field indicating when the {table_name} event occurred."),
+    ("id", "Unique identifier for the {table_name} record."),
+    ("name", "Name or identifier field in the {table_name} table."),
+    ("status|state", "Status or state information for the {table_name} event."),
+    ("message|description", "Descriptive message or details for the {table_name} event."),
+    ("count|number", "Numeric count or quantity field in the {table_name} table."),
+    ("source", "Source information for the {table_name} event."),
+    ("type", "Type or category classification for the {table_name} event."),
+))
+
+@dataclass(slots=True)
+class FieldInfo:
+    """A table column with its generated description; many of these are held per workspace"""
+    table_name: str
+    field_name: str
+    data_type: str
+    description: str
+    sample_values: Tuple[str, ...] = ()
+
 class SchemaGenerator:
     """Generates schemas and field descriptions from data source logs"""
     
@@ -20,39 +77,102 @@ class SchemaGenerator:
             "ContainerLog", "KubeEvents", "InsightsMetrics", "VMConnection",
             "SecurityAlert", "SecurityIncident", "ThreatIntelligenceIndicator"
         ]
+        # Background refreshes of cache entries past half their TTL, by cache key
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+    
+    async def _cached(self, key: str, fetch: Callable[[], Awaitable[Any]], should_store: Callable[[Any], bool]) -> Any:
+        """Serve key from the on-disk schema cache, fetching and storing it when missing or expired
+        
+        Entries past half their TTL are still returned, with a refresh started in the background
+        so the next caller gets fresh data without waiting for Log Analytics.
+        """
+        ttl = settings.schema_cache_ttl_seconds
+        entry = _schema_cache.get(key) if ttl > 0 else None
+        if entry is not None:
+            entry = json.loads(entry)
+            age = time.time() - entry["saved_at"]
+            if age < ttl:
+                if age > ttl / 2 and key not in self._refresh_tasks:
+                    task = asyncio.create_task(self._fetch_and_store(key, fetch, should_store))
+                    self._refresh_tasks[key] = task
+                    task.add_done_callback(lambda done: self._refresh_done(key, done))
+                return entry["value"]
+        return await self._fetch_and_store(key, fetch, should_store)
+    
+    def _refresh_done(self, key: str, task: asyncio.Task):
+        """Forget a finished background refresh, logging its failure; the stale entry stays in use"""
+        self._refresh_tasks.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background refresh of {key} failed: {task.exception()}")
     
-    def discover_tables(self, workspace_id: str, timespan_days: int = 7) -> List[str]:
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[Any]], should_store: Callable[[Any], bool]) -> Any:
+        value = await fetch()
+        if settings.schema_cache_ttl_seconds > 0 and should_store(value):
+            # Sample rows can hold datetimes; they are only ever used as strings.
+            # The SQLite commit runs in a worker thread so other tables' queries keep flowing meanwhile
+            await asyncio.to_thread(
+                _schema_cache.set, key, json.dumps({"saved_at": time.time(), "value": value}, default=str)
+            )
+        return value
+    
+    def clear_schema_cache(self):
+        """Forget cached tables and schemas so the next lookups go to Log Analytics"""
+        _schema_cache.clear()
+    
+    async def prewarm(self, workspace_id: str, timespan_days: int = 7, max_tables: int = 20):
+        """Discover the workspace's tables and extract their schemas into the on-disk cache"""
+        tables = await self.discover_tables(workspace_id, timespan_days)
+        log_analytics_slots = asyncio.Semaphore(8)
+        
+        async def warm(table_name: str):
+            async with log_analytics_slots:
+                await self.extract_table_schema(table_name, workspace_id, timespan_days)
+        
+        await asyncio.gather(*[warm(table_name) for table_name in tables[:max_tables]])
+        logger.info(f"Schema cache prewarmed for {min(len(tables), max_tables)} tables in workspace {workspace_id}")
+    
+    async def discover_tables(self, workspace_id: str, timespan_days: int = 7) -> List[str]:
         """Discover available tables in the workspace"""
         try:
-            # Query to get all tables with data in the last N days
-            discovery_query = f"""
-            union withsource=TableName *
-            | where TimeGenerated > ago({timespan_days}d)
-            | summarize Count=count() by TableName
-            | where Count > 0
-            | order by Count desc
-            | project TableName
-            """
-            
-            result = execute_kql(discovery_query, workspace_id=workspace_id, timespan_days=timespan_days)
-            
-            tables = []
-            if result and isinstance(result, list):
-                for table_data in result:
-                    if 'rows' in table_data:
-                        for row in table_data['rows']:
-                            if row and len(row) > 0:
-                                tables.append(row[0])
-            
-            logger.info(f"Discovered {len(tables)} tables with data")
-            return tables
-            
+            return await self._cached(
+                f"tables|{workspace_id}|{timespan_days}",
+                lambda: self._query_tables(workspace_id, timespan_days),
+                should_store=bool
+            )
         except Exception as e:
             logger.warning(f"Failed to discover tables: {e}. Using common tables.")
             return self.common_log_tables
     
-    def extract_table_schema(self, table_name: str, workspace_id: str, timespan_days: int = 7) -> Dict[str, Any]:
+    async def _query_tables(self, workspace_id: str, timespan_days: int) -> List[str]:
+        # Query to get all tables with data in the last N days
+        discovery_query = f"""
+        union withsource=TableName *
+        | where TimeGenerated > ago({timespan_days}d)
+        | summarize Count=count() by TableName
+        | where Count > 0
+        | order by Count desc
+        | project TableName
+        """
+        
+        result = await execute_kql(discovery_query, workspace_id=workspace_id, timespan_days=timespan_days)
+        
+        tables = []
+        if result and isinstance(result, list):
+            for table_data in result:
+                tables.extend(row[0] for row in table_data.get('rows', ()) if row)
+        
+        logger.info(f"Discovered {len(tables)} tables with data")
+        return tables
+    
+    async def extract_table_schema(self, table_name: str, workspace_id: str, timespan_days: int = 7) -> Dict[str, Any]:
         """Extract schema information for a specific table"""
+        return await self._cached(
+            f"schema|{workspace_id}|{table_name}|{timespan_days}",
+            lambda: self._query_table_schema(table_name, workspace_id, timespan_days),
+            should_store=lambda schema_info: bool(schema_info["columns"])
+        )
+    
+    async def _query_table_schema(self, table_name: str, workspace_id: str, timespan_days: int) -> Dict[str, Any]:
         try:
             # Query to get column information and sample data
             schema_query = f"""
@@ -62,7 +182,17 @@ class SchemaGenerator:
             | getschema
             """
             
-            result = execute_kql(schema_query, workspace_id=workspace_id, timespan_days=timespan_days)
+            # Get sample data for the table
+            sample_query = f"""
+            {table_name}
+            | where TimeGenerated > ago({timespan_days}d)
+            | take 10
+            """
+            
+            # Both queries go to Log Analytics in a single batch request
+            result, sample_result = await execute_kql_batch(
+                [schema_query, sample_query], workspace_id=workspace_id, timespan_days=timespan_days
+            )
             
             schema_info = {
                 "table_name": table_name,
@@ -73,26 +203,12 @@ class SchemaGenerator:
             if result and isinstance(result, list):
                 for table_data in result:
                     if 'columns' in table_data and 'rows' in table_data:
-                        columns = table_data['columns']
-                        rows = table_data['rows']
-                        
-                        for row in rows:
-                            if len(row) >= 2:  # getschema returns ColumnName, ColumnType
-                                column_info = {
-                                    "name": row[0],
-                                    "type": row[1],
-                                    "ordinal": row[2] if len(row) > 2 else 0
-                                }
-                                schema_info["columns"].append(column_info)
-            
-            # Get sample data for the table
-            sample_query = f"""
-            {table_name}
-            | where TimeGenerated > ago({timespan_days}d)
-            | take 10
-            """
+                        # getschema returns ColumnName, ColumnType[, ColumnOrdinal]
+                        schema_info["columns"].extend(
+                            {"name": row[0], "type": row[1], "ordinal": row[2] if len(row) > 2 else 0}
+                            for row in table_data['rows'] if len(row) >= 2
+                        )
             
-            sample_result = execute_kql(sample_query, workspace_id=workspace_id, timespan_days=timespan_days)
             if sample_result and isinstance(sample_result, list):
                 for table_data in sample_result:
                     if 'rows' in table_data:
@@ -104,7 +220,7 @@ class SchemaGenerator:
             logger.error(f"Failed to extract schema for table {table_name}: {e}")
             return {"table_name": table_name, "columns": [], "sample_data": []}
     
-    def generate_field_descriptions(self, schema_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def generate_field_descriptions(self, schema_info: Dict[str, Any]) -> List[FieldInfo]:
         """Generate AI-powered descriptions for fields based on schema and sample data"""
         field_descriptions = []
         
@@ -112,106 +228,123 @@ class SchemaGenerator:
         columns = schema_info["columns"]
         sample_data = schema_info.get("sample_data", [])
         
-        for column in columns:
+        # Transpose the sample rows once so each column's values are a single lookup
+        sample_columns = list(zip_longest(*sample_data)) if sample_data else []
+        
+        fields = []
+        for column_index, column in enumerate(columns):
             field_name = column["name"]
             data_type = column["type"]
             
             # Extract sample values for this column
             sample_values = []
-            if sample_data and len(sample_data) > 0:
-                column_index = next((i for i, col in enumerate(columns) if col["name"] == field_name), None)
-                if column_index is not None:
-                    for row in sample_data:
-                        if len(row) > column_index and row[column_index] is not None:
-                            sample_values.append(str(row[column_index]))
+            if column_index < len(sample_columns):
+                sample_values = [str(value) for value in sample_columns[column_index] if value is not None]
             
-            # Generate AI description
-            description = self._generate_ai_description(table_name, field_name, data_type, sample_values)
+            fields.append((field_name, data_type, sample_values))
+        
+        # Reuse descriptions generated by earlier runs for the same field and samples
+        keys = [
+            _description_key("field", table_name, field_name, data_type, ",".join(sample_values[:5]))
+            for field_name, data_type, sample_values in fields
+        ]
+        cached = _description_cache.get_many(keys)
+        missing = [field for field, key in zip(fields, keys) if key not in cached]
+        
+        # Generate AI descriptions for the rest, one chat completion per batch of fields,
+        # with the batches in flight together on the shared description pool
+        batches = [
+            missing[start:start + _DESCRIPTION_BATCH_SIZE]
+            for start in range(0, len(missing), _DESCRIPTION_BATCH_SIZE)
+        ]
+        descriptions = {}
+        for batch_descriptions in _description_pool.map(
+            lambda batch: self._generate_ai_descriptions_batch(table_name, batch), batches
+        ):
+            descriptions.update(batch_descriptions)
+        # Only AI descriptions are stored, so fields that fell back are retried next run
+        _description_cache.set_many({
+            key: descriptions[field_name]
+            for (field_name, _, _), key in zip(fields, keys)
+            if field_name in descriptions
+        })
+        
+        for (field_name, data_type, sample_values), key in zip(fields, keys):
+            description = (
+                cached.get(key) or descriptions.get(field_name)
+                or self._generate_fallback_description(table_name, field_name, data_type)
+            )
             
-            field_descriptions.append({
-                "table_name": table_name,
-                "field_name": field_name,
-                "data_type": data_type,
-                "description": description,
-                "sample_values": sample_values[:10]  # Keep first 10 samples
-            })
+            field_descriptions.append(FieldInfo(
+                table_name=table_name,
+                field_name=field_name,
+                data_type=data_type,
+                description=description,
+                sample_values=tuple(sample_values[:10])  # Keep first 10 samples
+            ))
         
         return field_descriptions
     
-    def _generate_ai_description(self, table_name: str, field_name: str, data_type: str, sample_values: List[str]) -> str:
-        """Generate AI-powered description for a field"""
+    def _generate_ai_descriptions_batch(self, table_name: str, fields: List[Tuple[str, str, List[str]]]) -> Dict[str, str]:
+        """Generate AI-powered descriptions for several fields of a table in one request
+        
+        Args:
+            fields: List of (field_name, data_type, sample_values) tuples
+        
+        Returns:
+            Dict of field name to description; fields the model did not describe are left out
+        """
         try:
-            # Create a prompt for generating field description
-            sample_values_str = ", ".join(sample_values[:5]) if sample_values else "No samples available"
-            
-            prompt = f"""
-            Generate a concise, technical description for this log analytics field:
-            
-            Table: {table_name}
-            Field: {field_name}
-            Data Type: {data_type}
-            Sample Values: {sample_values_str}
-            
-            Provide a 1-2 sentence description explaining what this field represents, its purpose, and any relevant context for KQL queries. Focus on practical usage for log analysis.
-            """
-            
-            headers = {
-                "Authorization": f"Bearer {settings.azure_openai_key}",
-                "Content-Type": "application/json"
-            }
+            # The instructions live in the static system message; only the fields vary per request
+            prompt = json.dumps({
+                "table": table_name,
+                "fields": [
+                    {"name": field_name, "type": data_type, "samples": sample_values[:5]}
+                    for field_name, data_type, sample_values in fields
+                ]
+            }, separators=(",", ":"))
             
             data = {
                 "messages": [
-                    {"role": "system", "content": "You are a log analytics expert. Generate concise, technical field descriptions."},
+                    {"role": "system", "content": _FIELD_DESCRIPTION_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 "temperature": 0.3,
-                "max_tokens": 150,
-                "model": "gpt-4.1-2025-04-14"
+                "max_tokens": 150 * len(fields),
+                "response_format": {"type": "json_object"},
+                "model": AOAI_MODEL
             }
             
-            response = requests.post(
-                f"{settings.azure_openai_endpoint}/openai/deployments/gpt-4.1-2025-04-14/chat/completions?api-version=2024-12-01-preview",
-                headers=headers,
-                json=data
-            )
+            response = post_with_retry_sync(AOAI_URL, headers=AOAI_HEADERS, content=encode_json(data))
             
             if response.status_code == 200:
-                description = response.json()["choices"][0]["message"]["content"].strip()
-                return description
+                descriptions = json.loads(response.json()["choices"][0]["message"]["content"])
+                return {
+                    field_name: description.strip()
+                    for field_name, description in descriptions.items()
+                    if isinstance(description, str) and description.strip()
+                }
             else:
-                logger.warning(f"Failed to generate AI description for {field_name}: {response.status_code}")
-                return self._generate_fallback_description(table_name, field_name, data_type)
+                logger.warning(f"Failed to generate AI descriptions for {table_name}: {response.status_code}")
+                return {}
                 
         except Exception as e:
-            logger.warning(f"Error generating AI description for {field_name}: {e}")
-            return self._generate_fallback_description(table_name, field_name, data_type)
+            logger.warning(f"Error generating AI descriptions for {table_name}: {e}")
+            return {}
     
-    def _generate_fallback_description(self, table_name: str, field_name: str, data_type: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _generate_fallback_description(table_name: str, field_name: str, data_type: str) -> str:
         """Generate a fallback description based on common patterns"""
         field_lower = field_name.lower()
         
-        # Common field patterns
-        if "time" in field_lower or "date" in field_lower:
-            return f"Timestamp field indicating when the {table_name} event occurred."
-        elif "id" in field_lower:
-            return f"Unique identifier for the {table_name} record."
-        elif "name" in field_lower:
-            return f"Name or identifier field in the {table_name} table."
-        elif "status" in field_lower or "state" in field_lower:
-            return f"Status or state information for the {table_name} event."
-        elif "message" in field_lower or "description" in field_lower:
-            return f"Descriptive message or details for the {table_name} event."
-        elif "count" in field_lower or "number" in field_lower:
-            return f"Numeric count or quantity field in the {table_name} table."
-        elif "source" in field_lower:
-            return f"Source information for the {table_name} event."
-        elif "type" in field_lower:
-            return f"Type or category classification for the {table_name} event."
-        else:
-            return f"Field in the {table_name} table of type {data_type}."
+        # Common field patterns, first match wins
+        for pattern, template in _FALLBACK_DESCRIPTIONS:
+            if pattern.search(field_lower):
+                return template.format(table_name=table_name)
+        return f"Field in the {table_name} table of type {data_type}."
     
-    def extract_field_values(self, table_name: str, field_name: str, workspace_id: str, timespan_days: int = 7, limit: int = 100) -> List[str]:
+    async def extract_field_values(self, table_name: str, field_name: str, workspace_id: str, timespan_days: int = 7, limit: int = 100) -> List[str]:
         """Extract sample values for a specific field"""
         try:
             values_query = f"""
@@ -224,15 +357,14 @@ class SchemaGenerator:
             | project {field_name}
             """
             
-            result = execute_kql(values_query, workspace_id=workspace_id, timespan_days=timespan_days)
+            result = await execute_kql(values_query, workspace_id=workspace_id, timespan_days=timespan_days)
             
             values = []
             if result and isinstance(result, list):
                 for table_data in result:
-                    if 'rows' in table_data:
-                        for row in table_data['rows']:
-                            if row and len(row) > 0 and row[0] is not None:
-                                values.append(str(row[0]))
+                    values.extend(
+                        str(row[0]) for row in table_data.get('rows', ()) if row and row[0] is not None
+                    )
             
             return values
             
@@ -244,39 +376,28 @@ class SchemaGenerator:
         """Generate a description for the entire table"""
         try:
             columns_info = ", ".join([f"{col['name']} ({col['type']})" for col in schema_info['columns'][:10]])
+            cache_key = _description_key("table", table_name, columns_info)
+            cached_description = _description_cache.get(cache_key)
+            if cached_description is not None:
+                return cached_description
             
-            prompt = f"""
-            Generate a concise description for this log analytics table:
-            
-            Table Name: {table_name}
-            Key Columns: {columns_info}
-            
-            Provide a 2-3 sentence description explaining what this table contains, what types of events or data it stores, and its primary use cases in log analytics and KQL queries.
-            """
-            
-            headers = {
-                "Authorization": f"Bearer {settings.azure_openai_key}",
-                "Content-Type": "application/json"
-            }
+            prompt = json.dumps({"table": table_name, "columns": columns_info}, separators=(",", ":"))
             
             data = {
                 "messages": [
-                    {"role": "system", "content": "You are a log analytics expert. Generate concise table descriptions."},
+                    {"role": "system", "content": _TABLE_DESCRIPTION_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 "temperature": 0.3,
                 "max_tokens": 200,
-                "model": "gpt-4.1-2025-04-14"
+                "model": AOAI_MODEL
             }
             
-            response = requests.post(
-                f"{settings.azure_openai_endpoint}/openai/deployments/gpt-4.1-2025-04-14/chat/completions?api-version=2024-12-01-preview",
-                headers=headers,
-                json=data
-            )
+            response = post_with_retry_sync(AOAI_URL, headers=AOAI_HEADERS, content=encode_json(data))
             
             if response.status_code == 200:
                 description = response.json()["choices"][0]["message"]["content"].strip()
+                _description_cache.set(cache_key, description)
                 return description
             else:
                 return f"Log analytics table containing {table_name} events and related data."
@@ -1,10 +1,57 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import json
+import re
+import heapq
 from collections import defaultdict
+from dataclasses import dataclass, field as dataclass_field
 
 logger = logging.getLogger(__name__)
 
+# Ignored when comparing the request with similar queries
+_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'show', 'get', 'find'
+})
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    """Regex matching any of the keywords anywhere in a string"""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+# The refined context is built and read attribute by attribute on every request, so its
+# records are slotted dataclasses rather than dicts
+
+@dataclass(slots=True)
+class RefinedField:
+    field_name: str
+    data_type: str
+    description: str
+    priority_score: float = 0.0
+    # Lowercased once here; the scoring passes compare it several times per field
+    name_lower: str = dataclass_field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.name_lower = self.field_name.lower()
+
+@dataclass(slots=True)
+class FieldSamples:
+    field_name: str
+    sample_values: List[Any]
+
+@dataclass(slots=True)
+class RefinedTable:
+    table_name: str
+    description: str
+    priority_score: float
+    fields: List[RefinedField] = dataclass_field(default_factory=list)
+    sample_values: List[FieldSamples] = dataclass_field(default_factory=list)
+
+@dataclass(slots=True)
+class QueryPattern:
+    similar_nl: str
+    kql_query: str
+    patterns: List[str]
+    relevance_score: float
+
 class SchemaRefiner:
     """Refines and processes retrieved schema information for optimal KQL generation"""
     
@@ -17,6 +64,14 @@ class SchemaRefiner:
             "UserName", "User", "Account", "IPAddress", "SourceIP", "DestinationIP",
             "ProcessName", "CommandLine", "FileName", "FilePath", "Message"
         ]
+        # Lowercased lookups built once instead of per field
+        self._priority_fields_lower = frozenset(pf.lower() for pf in self.priority_fields)
+        self._common_tables = frozenset(('securityevent', 'syslog', 'event', 'azureactivity', 'signinlogs'))
+        # Substring keyword checks, each compiled into one alternation scanned in a single pass
+        self._table_keywords_re = _keyword_pattern(('security', 'event', 'log', 'audit'))
+        self._useful_keywords_re = _keyword_pattern(
+            ('user', 'computer', 'process', 'file', 'ip', 'address', 'message', 'event', 'error', 'status')
+        )
     
     def refine_context(self, 
                       natural_language: str,
@@ -29,7 +84,11 @@ class SchemaRefiner:
         # Group fields by table
         fields_by_table = defaultdict(list)
         for field in relevant_fields:
-            fields_by_table[field['table_name']].append(field)
+            fields_by_table[field['table_name']].append(RefinedField(
+                field_name=field['field_name'],
+                data_type=field.get('data_type', ''),
+                description=field.get('description', '')
+            ))
         
         # Group values by table
         values_by_table = defaultdict(list)
@@ -57,42 +116,43 @@ class SchemaRefiner:
         }
     
     def _prioritize_and_refine_tables(self, 
-                                    fields_by_table: Dict[str, List[Dict[str, Any]]],
+                                    fields_by_table: Dict[str, List[RefinedField]],
                                     values_by_table: Dict[str, List[Dict[str, Any]]],
                                     schemas: List[Dict[str, Any]],
-                                    natural_language: str) -> List[Dict[str, Any]]:
+                                    natural_language: str) -> List[RefinedTable]:
         """Prioritize and refine table information"""
         
         refined_tables = []
         nl_lower = natural_language.lower()
+        # Query words matched against field descriptions and sample values, split once per request
+        nl_words = nl_lower.split()
+        description_words = tuple(word for word in nl_words if len(word) > 3)
+        sample_words = tuple(word for word in nl_words if len(word) > 2)
         
         # Create schema lookup
         schema_lookup = {schema['table_name']: schema for schema in schemas}
         
         # Process each table
         for table_name, fields in fields_by_table.items():
-            table_info = {
-                "table_name": table_name,
-                "description": schema_lookup.get(table_name, {}).get('description', ''),
-                "priority_score": self._calculate_table_priority(table_name, fields, nl_lower),
-                "fields": self._prioritize_fields(fields, nl_lower),
-                "sample_values": self._get_relevant_values(table_name, values_by_table, nl_lower)
-            }
+            table_info = RefinedTable(
+                table_name=table_name,
+                description=schema_lookup.get(table_name, {}).get('description', ''),
+                priority_score=self._calculate_table_priority(table_name, fields, nl_lower),
+                fields=self._prioritize_fields(fields, nl_lower, description_words),
+                sample_values=self._get_relevant_values(table_name, values_by_table, sample_words)
+            )
             refined_tables.append(table_info)
         
-        # Sort tables by priority
-        refined_tables.sort(key=lambda x: x['priority_score'], reverse=True)
-        
-        # Limit to top tables
-        return refined_tables[:5]
+        # Top tables by priority (nlargest keeps ties in input order, like a stable sort)
+        return heapq.nlargest(5, refined_tables, key=lambda x: x.priority_score)
     
-    def _calculate_table_priority(self, table_name: str, fields: List[Dict[str, Any]], nl_lower: str) -> float:
+    def _calculate_table_priority(self, table_name: str, fields: List[RefinedField], nl_lower: str) -> float:
         """Calculate priority score for a table based on relevance to the query"""
         score = 0.0
         
         # Table name relevance
         table_lower = table_name.lower()
-        if any(keyword in table_lower for keyword in ['security', 'event', 'log', 'audit']):
+        if self._table_keywords_re.search(table_lower):
             score += 1.0
         
         # Check if table name appears in natural language
@@ -101,28 +161,27 @@ class SchemaRefiner:
         
         # Field relevance
         for field in fields:
-            field_name_lower = field['field_name'].lower()
-            if field_name_lower in nl_lower:
+            if field.name_lower in nl_lower:
                 score += 1.5
-            if field_name_lower in [pf.lower() for pf in self.priority_fields]:
+            if field.name_lower in self._priority_fields_lower:
                 score += 0.5
         
         # Common log tables get slight boost
-        common_tables = ['securityevent', 'syslog', 'event', 'azureactivity', 'signinlogs']
-        if table_lower in common_tables:
+        if table_lower in self._common_tables:
             score += 0.5
         
         return score
     
-    def _prioritize_fields(self, fields: List[Dict[str, Any]], nl_lower: str) -> List[Dict[str, Any]]:
+    def _prioritize_fields(self, fields: List[RefinedField], nl_lower: str, description_words: Tuple[str, ...]) -> List[RefinedField]:
         """Prioritize and limit fields for a table"""
         
         # Calculate field scores
         for field in fields:
-            field['priority_score'] = self._calculate_field_priority(field, nl_lower)
+            field.priority_score = self._calculate_field_priority(field, nl_lower, description_words)
         
-        # Sort by priority
-        fields.sort(key=lambda x: x['priority_score'], reverse=True)
+        # Sort by priority; only the head is ever selected, and fields at or below 0.5 never are,
+        # so twice the per-table limit leaves room for skipped duplicates
+        fields = heapq.nlargest(self.max_fields_per_table * 2, fields, key=lambda x: x.priority_score)
         
         # Ensure priority fields are included
         priority_fields_included = set()
@@ -132,7 +191,7 @@ class SchemaRefiner:
             if len(final_fields) >= self.max_fields_per_table:
                 break
             
-            field_name_lower = field['field_name'].lower()
+            field_name_lower = field.name_lower
             
             # Always include TimeGenerated if available
             if field_name_lower == 'timegenerated':
@@ -141,41 +200,40 @@ class SchemaRefiner:
                 continue
             
             # Include high-priority fields
-            if (field_name_lower in [pf.lower() for pf in self.priority_fields] and 
+            if (field_name_lower in self._priority_fields_lower and 
                 field_name_lower not in priority_fields_included):
                 final_fields.append(field)
                 priority_fields_included.add(field_name_lower)
-            elif field['priority_score'] > 0.5:
+            elif field.priority_score > 0.5:
                 final_fields.append(field)
         
         return final_fields
     
-    def _calculate_field_priority(self, field: Dict[str, Any], nl_lower: str) -> float:
+    def _calculate_field_priority(self, field: RefinedField, nl_lower: str, description_words: Tuple[str, ...]) -> float:
         """Calculate priority score for a field"""
         score = 0.0
-        field_name_lower = field['field_name'].lower()
+        field_name_lower = field.name_lower
         
         # Direct mention in natural language
         if field_name_lower in nl_lower:
             score += 3.0
         
         # Priority fields
-        if field_name_lower in [pf.lower() for pf in self.priority_fields]:
+        if field_name_lower in self._priority_fields_lower:
             score += 2.0
         
         # Common useful fields
-        useful_keywords = ['user', 'computer', 'process', 'file', 'ip', 'address', 'message', 'event', 'error', 'status']
-        if any(keyword in field_name_lower for keyword in useful_keywords):
+        if self._useful_keywords_re.search(field_name_lower):
             score += 1.0
         
         # Field description relevance
-        description_lower = field.get('description', '').lower()
-        if any(word in description_lower for word in nl_lower.split() if len(word) > 3):
+        description_lower = field.description.lower()
+        if any(word in description_lower for word in description_words):
             score += 0.5
         
         return score
     
-    def _get_relevant_values(self, table_name: str, values_by_table: Dict[str, List[Dict[str, Any]]], nl_lower: str) -> List[Dict[str, Any]]:
+    def _get_relevant_values(self, table_name: str, values_by_table: Dict[str, List[Dict[str, Any]]], sample_words: Tuple[str, ...]) -> List[FieldSamples]:
         """Get relevant sample values for a table"""
         table_values = values_by_table.get(table_name, [])
         
@@ -187,36 +245,38 @@ class SchemaRefiner:
             
             for sample in sample_values[:self.max_sample_values]:
                 sample_lower = str(sample).lower()
-                if any(word in sample_lower for word in nl_lower.split() if len(word) > 2):
+                if any(word in sample_lower for word in sample_words):
                     relevant_samples.append(sample)
             
             if relevant_samples or len(relevant_values) < 3:
-                relevant_values.append({
-                    "field_name": value_info['field_name'],
-                    "sample_values": relevant_samples or sample_values[:self.max_sample_values]
-                })
+                relevant_values.append(FieldSamples(
+                    field_name=value_info['field_name'],
+                    sample_values=relevant_samples or sample_values[:self.max_sample_values]
+                ))
         
         return relevant_values[:5]  # Limit to 5 fields with values
     
-    def _extract_query_patterns(self, similar_queries: List[Dict[str, Any]], natural_language: str) -> List[Dict[str, Any]]:
+    def _extract_query_patterns(self, similar_queries: List[Dict[str, Any]], natural_language: str) -> List[QueryPattern]:
         """Extract useful patterns from similar queries"""
         patterns = []
+        # The request's own words are the same for every comparison
+        target_words = frozenset(natural_language.lower().split()) - _STOP_WORDS
         
         for query_info in similar_queries[:3]:  # Top 3 similar queries
             kql_query = query_info.get('kql_query', '')
             nl_query = query_info.get('natural_language', '')
             
             # Extract common KQL patterns
-            pattern_info = {
-                "similar_nl": nl_query,
-                "kql_query": kql_query,
-                "patterns": self._identify_kql_patterns(kql_query),
-                "relevance_score": self._calculate_query_relevance(nl_query, natural_language)
-            }
+            pattern_info = QueryPattern(
+                similar_nl=nl_query,
+                kql_query=kql_query,
+                patterns=self._identify_kql_patterns(kql_query),
+                relevance_score=self._calculate_query_relevance(nl_query, target_words)
+            )
             patterns.append(pattern_info)
         
         # Sort by relevance
-        patterns.sort(key=lambda x: x['relevance_score'], reverse=True)
+        patterns.sort(key=lambda x: x.relevance_score, reverse=True)
         return patterns
     
     def _identify_kql_patterns(self, kql_query: str) -> List[str]:
@@ -246,15 +306,10 @@ class SchemaRefiner:
         
         return patterns
     
-    def _calculate_query_relevance(self, similar_nl: str, target_nl: str) -> float:
-        """Calculate relevance score between two natural language queries"""
-        similar_words = set(similar_nl.lower().split())
-        target_words = set(target_nl.lower().split())
-        
+    def _calculate_query_relevance(self, similar_nl: str, target_words: frozenset) -> float:
+        """Calculate relevance score between a similar query and the request's non-stop words"""
         # Remove common stop words
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'show', 'get', 'find'}
-        similar_words -= stop_words
-        target_words -= stop_words
+        similar_words = frozenset(similar_nl.lower().split()) - _STOP_WORDS
         
         if not target_words:
             return 0.0
@@ -267,8 +322,8 @@ class SchemaRefiner:
     
     def _generate_refined_instructions(self, 
                                      natural_language: str,
-                                     refined_tables: List[Dict[str, Any]],
-                                     query_patterns: List[Dict[str, Any]]) -> str:
+                                     refined_tables: List[RefinedTable],
+                                     query_patterns: List[QueryPattern]) -> str:
         """Generate refined instructions for KQL generation"""
         
         instructions = []
@@ -280,11 +335,11 @@ class SchemaRefiner:
         if refined_tables:
             instructions.append("\nAvailable Tables:")
             for table in refined_tables[:3]:  # Top 3 tables
-                table_desc = f"- {table['table_name']}: {table['description'][:100]}..."
+                table_desc = f"- {table.table_name}: {table.description[:100]}..."
                 instructions.append(table_desc)
                 
                 # Key fields
-                key_fields = [f['field_name'] for f in table['fields'][:5]]
+                key_fields = [f.field_name for f in table.fields[:5]]
                 if key_fields:
                     instructions.append(f"  Key fields: {', '.join(key_fields)}")
         
@@ -292,8 +347,8 @@ class SchemaRefiner:
         if query_patterns:
             instructions.append("\nSimilar Query Patterns:")
             for pattern in query_patterns[:2]:
-                if pattern['patterns']:
-                    instructions.append(f"- Uses: {', '.join(pattern['patterns'])}")
+                if pattern.patterns:
+                    instructions.append(f"- Uses: {', '.join(pattern.patterns)}")
         
         # Specific guidance
         instructions.append("\nGuidelines:")
@@ -304,18 +359,18 @@ class SchemaRefiner:
         
         return "\n".join(instructions)
     
-    def _generate_context_summary(self, refined_tables: List[Dict[str, Any]], query_patterns: List[Dict[str, Any]]) -> str:
+    def _generate_context_summary(self, refined_tables: List[RefinedTable], query_patterns: List[QueryPattern]) -> str:
         """Generate a concise summary of the context"""
         summary_parts = []
         
         if refined_tables:
-            table_names = [table['table_name'] for table in refined_tables[:3]]
+            table_names = [table.table_name for table in refined_tables[:3]]
             summary_parts.append(f"Tables: {', '.join(table_names)}")
         
         if query_patterns:
             all_patterns = set()
             for pattern in query_patterns:
-                all_patterns.update(pattern['patterns'])
+                all_patterns.update(pattern.patterns)
             if all_patterns:
                 summary_parts.append(f"Patterns: {', '.join(list(all_patterns)[:5])}")
         
@@ -39,4 +39,18 @@ class FeedbackRequest(BaseModel):
     natural_language: str
     generated_kql: str
     user_feedback: str
-    corrected_kql: Optional[str] = None 
\ No newline at end of file
+    corrected_kql: Optional[str] = None
+
+class BatchSubmitResponse(BaseModel):
+    batch_id: str
+    status: str
+
+class BatchResultItem(BaseModel):
+    index: int
+    kql_query: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    status: str
+    results: Optional[List[BatchResultItem]] = None
@@ -0,0 +1,149 @@
+import chromadb
+from chromadb.config import Settings
+from typing import Optional
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """Embedding-similarity cache that maps paraphrased NL prompts to previously generated KQL"""
+
+    def __init__(self, persist_directory: str = "./chroma_db", similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 3600, embedder=None, max_entries: int = 10000,
+                 eviction_interval_seconds: float = 300):
+        self.persist_directory = Path(persist_directory)
+        self.persist_directory.mkdir(exist_ok=True)
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.eviction_interval_seconds = eviction_interval_seconds
+        self._embedder = embedder
+        self._collection = None
+        self._last_eviction = 0.0
+        self._eviction_lock = threading.Lock()
+
+    def attach_embedder(self, embedder):
+        """Reuse an already-loaded embedder (e.g. the VectorStore one) instead of loading a second model"""
+        self._embedder = embedder
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info("Loading sentence transformer model for the semantic cache...")
+            self._embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._embedder
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            client = chromadb.PersistentClient(
+                path=str(self.persist_directory),
+                settings=Settings(anonymized_telemetry=False)
+            )
+            self._collection = client.get_or_create_collection(
+                "semantic_cache", metadata={"hnsw:space": "cosine"}
+            )
+        return self._collection
+
+    def _namespace(self, workspace_id: Optional[str], context: Optional[str]) -> dict:
+        """Entries only match prompts for the same workspace and the same extra context"""
+        context_hash = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+        return {"$and": [{"workspace_id": workspace_id or ""}, {"context_hash": context_hash}]}
+
+    def embed(self, natural_language: str) -> Optional[list]:
+        """Embed a prompt once so lookup() and a following store() can share the vector"""
+        try:
+            return self.embedder.encode([natural_language]).tolist()
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+
+    def lookup(self, natural_language: str, workspace_id: str = None, context: str = None,
+               embedding: Optional[list] = None) -> Optional[str]:
+        """Return cached KQL for a semantically equivalent prompt, or None on a miss"""
+        try:
+            if self.collection.count() == 0:
+                return None
+
+            query_embedding = embedding or self.embedder.encode([natural_language]).tolist()
+            results = self.collection.query(
+                query_embeddings=query_embedding,
+                n_results=1,
+                where=self._namespace(workspace_id, context)
+            )
+
+            if not results['ids'] or not results['ids'][0]:
+                return None
+
+            entry_id = results['ids'][0][0]
+            metadata = results['metadatas'][0][0]
+            similarity = 1.0 - results['distances'][0][0]
+
+            if time.time() - metadata['created_at'] > self.ttl_seconds:
+                self.collection.delete(ids=[entry_id])
+                return None
+
+            if similarity < self.similarity_threshold:
+                return None
+
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for: {natural_language}")
+            return metadata['kql']
+
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None
+
+    def store(self, natural_language: str, kql: str, workspace_id: str = None, context: str = None,
+              embedding: Optional[list] = None):
+        """Remember the KQL generated for a prompt, reusing the embedding from lookup() if given"""
+        try:
+            namespace = self._namespace(workspace_id, context)["$and"]
+            now = time.time()
+            self.collection.add(
+                documents=[natural_language],
+                metadatas=[{
+                    "kql": kql,
+                    "workspace_id": namespace[0]["workspace_id"],
+                    "context_hash": namespace[1]["context_hash"],
+                    "created_at": now
+                }],
+                embeddings=embedding or self.embedder.encode([natural_language]).tolist(),
+                ids=[f"semantic_{uuid.uuid4().hex}"]
+            )
+            if now - self._last_eviction > self.eviction_interval_seconds or self.collection.count() > self.max_entries:
+                self._evict(now)
+        except Exception as e:
+            logger.warning(f"Failed to store entry in semantic cache: {e}")
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the oldest ones while the cache is over max_entries"""
+        # Concurrent stores leave eviction to whichever thread got here first
+        if not self._eviction_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_eviction = now
+            self.collection.delete(where={"created_at": {"$lt": now - self.ttl_seconds}})
+
+            excess = self.collection.count() - self.max_entries
+            if excess > 0:
+                # Trim to 90% of the cap so the next few stores do not trigger another full scan
+                excess += self.max_entries // 10
+                entries = self.collection.get(include=["metadatas"])
+                oldest = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda e: e[1]["created_at"])
+                self.collection.delete(ids=[entry_id for entry_id, _ in oldest[:excess]])
+                logger.info(f"Evicted {excess} oldest semantic cache entries")
+        finally:
+            self._eviction_lock.release()
+
+    def clear(self):
+        if self.collection.count() > 0:
+            self.collection.delete(ids=self.collection.get()['ids'])
+
+# Global instance
+semantic_cache = SemanticCache()
@@ -2,222 +2,499 @@ import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+from functools import lru_cache
+from itertools import groupby
+import hashlib
 import json
 import logging
+import msgspec
+import time
 from pathlib import Path
 import ssl
 import certifi
 import os
 
+if TYPE_CHECKING:
+    from .schema_generator import FieldInfo
+
 logger = logging.getLogger(__name__)
 
+_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+# Field descriptions, sample values and questions are short; attention cost grows with the square
+# of the sequence length, so inputs are capped below the model's default of 256 tokens
+_MAX_SEQ_LENGTH = 128
+
+# Dynamically int8-quantized ONNX export of the model, as published in the model repo
+_ONNX_QINT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+_HF_REPO_ID = f"sentence-transformers/{_EMBEDDING_MODEL}"
+
+# Chroma indexes every collection with HNSW; these are the graph parameters for new collections.
+# A higher construction ef gives a better graph for the mostly write-once schema data, and a
+# search ef of 64 is plenty for the n_results <= 15 lookups done per request.
+# Embeddings are unit-length, so inner product ranks exactly like cosine similarity without
+# the per-comparison norm computation.
+_HNSW_METADATA = {"hnsw:space": "ip", "hnsw:M": 16, "hnsw:construction_ef": 200, "hnsw:search_ef": 64}
+
+# Collections populated from a workspace, plus the ground truth examples
+_COLLECTION_NAMES = ("field_descriptions", "field_values", "schemas", "ground_truth_pairs")
+
+# Documents are encoded and inserted this many at a time, bounding peak memory on large ingests
+_INGEST_BATCH_SIZE = 512
+
+def _detect_device() -> str:
+    """Best available torch device for the embedder: CUDA, then Apple MPS, then CPU"""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except Exception:
+        pass
+    return "cpu"
+
+def _is_connection_error(error: BaseException) -> bool:
+    """Whether a model load failed because the Hugging Face Hub could not be reached"""
+    from huggingface_hub.errors import LocalEntryNotFoundError
+    
+    while error is not None:
+        if isinstance(error, (LocalEntryNotFoundError, ConnectionError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def _optimal_batch_size(device: str) -> int:
+    """Encode batch size for the device: large on a roomy CUDA GPU, small on MPS and memory-tight GPUs"""
+    if device == "cuda":
+        try:
+            import torch
+            free_bytes, _ = torch.cuda.mem_get_info()
+            return 256 if free_bytes > 8 * 1024 ** 3 else 32
+        except Exception:
+            return 32
+    if device == "mps":
+        return 32
+    return 64
+
 class VectorStore:
     """Vector store for managing embeddings and similarity search in the multi-RAG workflow"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", quantize_embedder: bool = True,
+                 half_precision: bool = True):
         self.persist_directory = Path(persist_directory)
         self.persist_directory.mkdir(exist_ok=True)
         
+        # Set when a model load could not reach the hub, so later fallbacks only look at the local cache
+        self._hub_unreachable = False
+        
         # Initialize ChromaDB with persistence
         self.client = chromadb.PersistentClient(
             path=str(self.persist_directory),
             settings=Settings(anonymized_telemetry=False)
         )
         
-        # Initialize sentence transformer for embeddings with SSL fix
-        self.embedder = self._initialize_embedder()
+        # On a CUDA GPU the model runs in FP16 with larger batches; on CPU the int8 ONNX Runtime model
+        # is preferred, with the PyTorch model (quantized in place) as the fallback
+        self.device = _detect_device()
+        self.encode_batch_size = _optimal_batch_size(self.device)
+        self.embedder = self._load_onnx_embedder() if quantize_embedder and self.device == "cpu" else None
+        if self.embedder is not None:
+            # Identifies the vectors this embedder produces, for on-disk embedding caches (None: not cacheable)
+            self.embedder_id = f"{_EMBEDDING_MODEL}-onnx-int8"
+        else:
+            # Initialize sentence transformer for embeddings with SSL fix
+            self.embedder = self._initialize_embedder()
+            self.embedder_id = None if isinstance(self.embedder, MockEmbedder) else _EMBEDDING_MODEL
+            if self.device == "cuda" and half_precision and self.embedder_id is not None:
+                self.embedder.half()
+                self.embedder_id = f"{_EMBEDDING_MODEL}-fp16"
+            elif quantize_embedder and self.device == "cpu":
+                quantized = self._quantize_embedder(self.embedder)
+                if quantized is not self.embedder:
+                    self.embedder = quantized
+                    self.embedder_id = f"{_EMBEDDING_MODEL}-int8"
+        if self.embedder_id is not None:
+            self.embedder.max_seq_length = _MAX_SEQ_LENGTH
+            self.embedder_id += f"-seq{_MAX_SEQ_LENGTH}"
+            # Pay for lazy weight loading, kernel selection and ORT graph optimization now
+            # rather than on the first user query
+            try:
+                self.embedder.encode(["warmup"], convert_to_numpy=True)
+            except Exception as e:
+                logger.warning(f"Embedder warm-up failed: {e}")
+        
+        # Query embeddings are reused across the four searches of a request and across repeated questions
+        self._embed_query_cached = lru_cache(maxsize=512)(self._encode_query)
+        # Document embeddings by content hash, persisted so re-ingesting unchanged text skips the encoder
+        self._embedding_cache: Optional[Dict[str, np.ndarray]] = None
         
         # Initialize collections for different types of data
-        self.field_descriptions_collection = self._get_or_create_collection("field_descriptions")
-        self.field_values_collection = self._get_or_create_collection("field_values")
-        self.schemas_collection = self._get_or_create_collection("schemas")
-        self.ground_truth_collection = self._get_or_create_collection("ground_truth_pairs")
+        self._open_collections()
         
         logger.info(f"VectorStore initialized with persist directory: {self.persist_directory}")
     
+    @staticmethod
+    def _use_certifi_bundle():
+        """Point model downloads at the certifi certificates"""
+        # Set SSL context to use certifi certificates
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        
+        # Set environment variables for SSL
+        os.environ['CURL_CA_BUNDLE'] = certifi.where()
+        os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
+    
+    def _load_onnx_embedder(self):
+        """Load the int8 ONNX Runtime model, exporting it under the persist directory if needed
+        
+        Returns None when ONNX Runtime or the model is unavailable. The hub is contacted at most
+        once: an unreachable hub ends the attempt, and the export only uses locally cached weights.
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            return None
+        
+        # Full graph optimization (constant folding, attention and layer norm fusion) and one
+        # intra-op thread per physical core, approximated as half the logical CPUs
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        session_options.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+        model_kwargs = {
+            "file_name": _ONNX_QINT8_FILE,
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options
+        }
+        
+        export_dir = self.persist_directory / "onnx" / _EMBEDDING_MODEL
+        try:
+            self._use_certifi_bundle()
+            model_path = str(export_dir) if (export_dir / _ONNX_QINT8_FILE).exists() else _EMBEDDING_MODEL
+            embedder = SentenceTransformer(model_path, backend="onnx", model_kwargs=model_kwargs)
+            logger.info(f"Loaded int8 ONNX sentence transformer from {model_path}")
+            return embedder
+        except Exception as e:
+            if _is_connection_error(e):
+                logger.warning(f"Hugging Face Hub unreachable, not using the int8 ONNX sentence transformer: {e}")
+                self._hub_unreachable = True
+                return None
+            logger.info(f"No prebuilt int8 ONNX model available ({e})")
+        
+        try:
+            from huggingface_hub import try_to_load_from_cache
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            if not isinstance(try_to_load_from_cache(repo_id=_HF_REPO_ID, filename="model.safetensors"), str):
+                logger.info("Model weights are not cached locally, skipping the int8 ONNX export")
+                return None
+            logger.info("Exporting an int8 ONNX sentence transformer")
+            model = SentenceTransformer(_EMBEDDING_MODEL, backend="onnx", local_files_only=True)
+            model.save(str(export_dir))
+            export_dynamic_quantized_onnx_model(model, "avx512_vnni", str(export_dir))
+            embedder = SentenceTransformer(str(export_dir), backend="onnx", model_kwargs=model_kwargs)
+            logger.info(f"Exported int8 ONNX sentence transformer to {export_dir}")
+            return embedder
+        except Exception as e:
+            logger.warning(f"Failed to set up the int8 ONNX sentence transformer, using PyTorch: {e}")
+            return None
+    
     def _initialize_embedder(self):
         """Initialize sentence transformer with SSL handling"""
         try:
-            # Set SSL context to use certifi certificates
-            ssl_context = ssl.create_default_context(cafile=certifi.where())
-            
-            # Set environment variables for SSL
-            os.environ['CURL_CA_BUNDLE'] = certifi.where()
-            os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
+            self._use_certifi_bundle()
             
             logger.info("Initializing sentence transformer model...")
-            embedder = SentenceTransformer('all-MiniLM-L6-v2')
+            embedder = SentenceTransformer(_EMBEDDING_MODEL, device=self.device, local_files_only=self._hub_unreachable)
             logger.info("Sentence transformer model loaded successfully")
             return embedder
             
         except Exception as e:
             logger.warning(f"Failed to load sentence transformer model: {e}")
             logger.info("Attempting to use a simpler embedding approach...")
+            self._hub_unreachable = self._hub_unreachable or _is_connection_error(e)
             
             try:
                 # Try with trust_remote_code=False and local_files_only if model exists
-                embedder = SentenceTransformer('all-MiniLM-L6-v2', trust_remote_code=False)
+                embedder = SentenceTransformer(
+                    _EMBEDDING_MODEL, trust_remote_code=False, device=self.device, local_files_only=self._hub_unreachable
+                )
                 return embedder
             except Exception as e2:
                 logger.error(f"Failed to load any sentence transformer model: {e2}")
                 # Return a mock embedder for testing
                 return MockEmbedder()
     
-    def _get_or_create_collection(self, name: str):
-        """Get or create a ChromaDB collection"""
+    def _quantize_embedder(self, embedder):
+        """Apply dynamic int8 quantization to the embedder's linear layers for faster CPU inference"""
         try:
-            return self.client.get_collection(name)
-        except Exception:  # Changed from ValueError to Exception to catch all errors
-            return self.client.create_collection(name)
+            import torch
+            if not isinstance(embedder, torch.nn.Module) or torch.cuda.is_available():
+                # MockEmbedder has nothing to quantize, and on GPU the model runs in FP16 instead
+                return embedder
+            quantized = torch.ao.quantization.quantize_dynamic(embedder, {torch.nn.Linear}, dtype=torch.qint8)
+            logger.info("Applied dynamic int8 quantization to the sentence transformer")
+            return quantized
+        except Exception as e:
+            logger.warning(f"Failed to quantize sentence transformer, using FP32 model: {e}")
+            return embedder
     
-    def add_field_descriptions(self, field_descriptions: List[Dict[str, Any]]):
-        """Add field descriptions to the vector store
+    def _get_or_create_collection(self, name: str):
+        """Get or create a ChromaDB collection
         
-        Args:
-            field_descriptions: List of dicts with keys: table_name, field_name, description, data_type
+        Chroma keeps the index settings an existing collection was created with, so one built
+        with a different distance space or HNSW tuning is flagged for a rebuild via collections_outdated.
         """
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for i, field_desc in enumerate(field_descriptions):
-            # Create a rich description for embedding
-            doc_text = f"Table: {field_desc['table_name']}, Field: {field_desc['field_name']}, Type: {field_desc['data_type']}, Description: {field_desc['description']}"
-            documents.append(doc_text)
-            
-            metadatas.append({
-                "table_name": field_desc['table_name'],
-                "field_name": field_desc['field_name'],
-                "data_type": field_desc['data_type'],
-                "description": field_desc['description']
-            })
-            
-            ids.append(f"field_{field_desc['table_name']}_{field_desc['field_name']}_{i}")
+        collection = self.client.get_or_create_collection(name, metadata=_HNSW_METADATA)
+        stored = collection.metadata or {}
+        outdated = [key for key, value in _HNSW_METADATA.items() if stored.get(key) != value]
+        if outdated:
+            logger.warning(
+                f"Collection {name} was created with different {', '.join(outdated)} settings; "
+                f"it is rebuilt on the next population"
+            )
+            self.collections_outdated = True
+        return collection
+    
+    def _open_collections(self):
+        # Set by _get_or_create_collection; a full repopulation recreates the collections with current settings
+        self.collections_outdated = False
+        self.field_descriptions_collection = self._get_or_create_collection("field_descriptions")
+        self.field_values_collection = self._get_or_create_collection("field_values")
+        self.schemas_collection = self._get_or_create_collection("schemas")
+        self.ground_truth_collection = self._get_or_create_collection("ground_truth_pairs")
+    
+    def reset_collections(self):
+        """Drop and recreate all collections ahead of a full repopulation
         
-        # Generate embeddings
-        embeddings = self.embedder.encode(documents).tolist()
+        Chroma ignores add() for ids that already exist, so repopulating in place would keep
+        vectors from an earlier embedder and entries for tables that are gone. The manifest is
+        removed too, so an interrupted repopulation is never reported as a fresh snapshot.
+        """
+        (self.persist_directory / "manifest.json").unlink(missing_ok=True)
+        for name in _COLLECTION_NAMES:
+            try:
+                self.client.delete_collection(name)
+            except Exception:
+                pass  # Not created yet
+        self._open_collections()
+    
+    def add_field_descriptions(self, field_descriptions: List["FieldInfo"]):
+        """Add field descriptions to the vector store
         
-        self.field_descriptions_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            embeddings=embeddings,
-            ids=ids
-        )
+        Args:
+            field_descriptions: FieldInfo records from SchemaGenerator.generate_field_descriptions
+        """
+        self._ingest([(self.field_descriptions_collection, self._field_description_documents(field_descriptions))])
         
         logger.info(f"Added {len(field_descriptions)} field descriptions to vector store")
     
+    def _field_description_documents(self, field_descriptions: List["FieldInfo"]) -> Tuple[List[str], List[dict], List[str]]:
+        # Create a rich description for embedding
+        documents = [
+            f"Table: {f.table_name}, Field: {f.field_name}, Type: {f.data_type}, Description: {f.description}"
+            for f in field_descriptions
+        ]
+        metadatas = [
+            {"table_name": f.table_name, "field_name": f.field_name, "data_type": f.data_type, "description": f.description}
+            for f in field_descriptions
+        ]
+        ids = [f"field_{f.table_name}_{f.field_name}_{i}" for i, f in enumerate(field_descriptions)]
+        
+        return documents, metadatas, ids
+    
     def add_field_values(self, field_values: List[Dict[str, Any]]):
         """Add field values to the vector store
         
         Args:
             field_values: List of dicts with keys: table_name, field_name, sample_values
         """
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for i, field_val in enumerate(field_values):
-            # Create a document with sample values
-            sample_values_str = ", ".join(str(v) for v in field_val['sample_values'][:10])  # Limit to 10 samples
-            doc_text = f"Table: {field_val['table_name']}, Field: {field_val['field_name']}, Sample values: {sample_values_str}"
-            documents.append(doc_text)
-            
-            metadatas.append({
-                "table_name": field_val['table_name'],
-                "field_name": field_val['field_name'],
-                "sample_values": json.dumps(field_val['sample_values'][:20])  # Store up to 20 samples
-            })
-            
-            ids.append(f"values_{field_val['table_name']}_{field_val['field_name']}_{i}")
-        
-        # Generate embeddings
-        embeddings = self.embedder.encode(documents).tolist()
-        
-        self.field_values_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            embeddings=embeddings,
-            ids=ids
-        )
+        self._ingest([(self.field_values_collection, self._field_value_documents(field_values))])
         
         logger.info(f"Added {len(field_values)} field value sets to vector store")
     
+    def _field_value_documents(self, field_values: List[Dict[str, Any]]) -> Tuple[List[str], List[dict], List[str]]:
+        # Create a document with sample values (limit to 10 samples)
+        documents = [
+            f"Table: {v['table_name']}, Field: {v['field_name']}, "
+            f"Sample values: {', '.join(map(str, v['sample_values'][:10]))}"
+            for v in field_values
+        ]
+        metadatas = [
+            # Store up to 20 samples
+            {"table_name": v['table_name'], "field_name": v['field_name'], "sample_values": msgspec.json.encode(v['sample_values'][:20]).decode()}
+            for v in field_values
+        ]
+        ids = [f"values_{v['table_name']}_{v['field_name']}_{i}" for i, v in enumerate(field_values)]
+        
+        return documents, metadatas, ids
+    
     def add_schemas(self, schemas: List[Dict[str, Any]]):
         """Add table schemas to the vector store
         
         Args:
             schemas: List of dicts with keys: table_name, schema, description
         """
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for i, schema in enumerate(schemas):
-            # Create a document with schema information
-            doc_text = f"Table: {schema['table_name']}, Description: {schema['description']}, Schema: {schema['schema']}"
-            documents.append(doc_text)
-            
-            metadatas.append({
-                "table_name": schema['table_name'],
-                "schema": schema['schema'],
-                "description": schema['description']
-            })
-            
-            ids.append(f"schema_{schema['table_name']}_{i}")
-        
-        # Generate embeddings
-        embeddings = self.embedder.encode(documents).tolist()
-        
-        self.schemas_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            embeddings=embeddings,
-            ids=ids
-        )
+        self._ingest([(self.schemas_collection, self._schema_documents(schemas))])
         
         logger.info(f"Added {len(schemas)} schemas to vector store")
     
-    def add_ground_truth_pairs(self, pairs: List[Dict[str, Any]]):
+    def _schema_documents(self, schemas: List[Dict[str, Any]]) -> Tuple[List[str], List[dict], List[str]]:
+        # Create a document with schema information
+        documents = [
+            f"Table: {schema['table_name']}, Description: {schema['description']}, Schema: {schema['schema']}"
+            for schema in schemas
+        ]
+        metadatas = [
+            {"table_name": schema['table_name'], "schema": schema['schema'], "description": schema['description']}
+            for schema in schemas
+        ]
+        ids = [f"schema_{schema['table_name']}_{i}" for i, schema in enumerate(schemas)]
+        
+        return documents, metadatas, ids
+    
+    def add_all(self, field_descriptions: List["FieldInfo"], field_values: List[Dict[str, Any]],
+                schemas: List[Dict[str, Any]]):
+        """Add field descriptions, field values and schemas, encoding their documents together rather than per collection"""
+        self._ingest([
+            (self.field_descriptions_collection, self._field_description_documents(field_descriptions)),
+            (self.field_values_collection, self._field_value_documents(field_values)),
+            (self.schemas_collection, self._schema_documents(schemas))
+        ])
+        
+        logger.info(f"Added {len(field_descriptions)} field descriptions, {len(field_values)} field value sets "
+                    f"and {len(schemas)} schemas to vector store")
+    
+    def add_ground_truth_pairs(self, pairs: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
         """Add ground truth NL2KQL pairs to the vector store
         
         Args:
             pairs: List of dicts with keys: natural_language, kql_query, description
+            embeddings: Precomputed embeddings of each pair's natural_language, encoded if not given
         """
-        documents = []
-        metadatas = []
-        ids = []
+        # Use natural language as the document for similarity search
+        documents = [pair['natural_language'] for pair in pairs]
+        metadatas = [
+            {"natural_language": pair['natural_language'], "kql_query": pair['kql_query'], "description": pair.get('description', '')}
+            for pair in pairs
+        ]
+        ids = [f"ground_truth_{i}" for i in range(len(pairs))]
         
-        for i, pair in enumerate(pairs):
-            # Use natural language as the document for similarity search
-            documents.append(pair['natural_language'])
-            
-            metadatas.append({
-                "natural_language": pair['natural_language'],
-                "kql_query": pair['kql_query'],
-                "description": pair.get('description', '')
-            })
-            
-            ids.append(f"ground_truth_{i}")
+        self._ingest([(self.ground_truth_collection, (documents, metadatas, ids))], embeddings=embeddings)
         
-        # Generate embeddings
-        embeddings = self.embedder.encode(documents).tolist()
+        logger.info(f"Added {len(pairs)} ground truth pairs to vector store")
+    
+    def _ingest(self, batches: List[Tuple[Any, Tuple[List[str], List[dict], List[str]]]],
+                embeddings: Optional[np.ndarray] = None):
+        """Encode and insert (collection, (documents, metadatas, ids)) batches in bounded chunks
         
-        self.ground_truth_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            embeddings=embeddings,
-            ids=ids
-        )
+        Chunks run across collection boundaries, so each chunk is still a single encode call.
+        Precomputed embeddings, if given, cover all documents in order and are sliced instead.
+        """
+        owners = [k for k, (_, (documents, _, _)) in enumerate(batches) for _ in documents]
+        documents = [doc for _, (docs, _, _) in batches for doc in docs]
+        metadatas = [metadata for _, (_, metas, _) in batches for metadata in metas]
+        ids = [doc_id for _, (_, _, doc_ids) in batches for doc_id in doc_ids]
+        
+        for start in range(0, len(documents), _INGEST_BATCH_SIZE):
+            end = min(start + _INGEST_BATCH_SIZE, len(documents))
+            if embeddings is None:
+                chunk_embeddings = self.encode_documents(documents[start:end])
+            else:
+                chunk_embeddings = embeddings[start:end]
+            
+            for owner, positions in groupby(range(start, end), key=owners.__getitem__):
+                positions = list(positions)
+                lo, hi = positions[0], positions[-1] + 1
+                batches[owner][0].add(
+                    documents=documents[lo:hi],
+                    metadatas=metadatas[lo:hi],
+                    embeddings=chunk_embeddings[lo - start:hi - start],
+                    ids=ids[lo:hi]
+                )
+    
+    def encode_documents(self, documents: List[str]) -> np.ndarray:
+        """Encode a whole ingestion batch in one call so tokenization and forward passes are batched
         
-        logger.info(f"Added {len(pairs)} ground truth pairs to vector store")
+        Repeated texts are encoded once and their vector reused for every occurrence.
+        """
+        positions = {}
+        index = np.fromiter(
+            (positions.setdefault(doc, len(positions)) for doc in documents), dtype=np.intp, count=len(documents)
+        )
+        unique_documents = list(positions)
+        embeddings = self._encode_unique(unique_documents)
+        if len(unique_documents) == len(documents):
+            return embeddings
+        return np.asarray(embeddings)[index]
+    
+    def _encode_unique(self, documents: List[str]) -> np.ndarray:
+        """Encode distinct documents, taking vectors for previously seen texts from the embedding cache"""
+        if self.embedder_id is None or not documents:
+            return self._encode(documents)
+        
+        cache = self._load_embedding_cache()
+        keys = [hashlib.blake2b(doc.encode("utf-8"), digest_size=16).hexdigest() for doc in documents]
+        missing = [i for i, key in enumerate(keys) if key not in cache]
+        if missing:
+            new_embeddings = np.asarray(self._encode([documents[i] for i in missing]), dtype=np.float32)
+            for i, embedding in zip(missing, new_embeddings):
+                cache[keys[i]] = embedding
+            self._save_embedding_cache()
+        logger.info(f"Embedding cache: {len(documents) - len(missing)} hits, {len(missing)} documents encoded")
+        return np.stack([cache[key] for key in keys])
+    
+    def _encode(self, documents: List[str]) -> np.ndarray:
+        return self.embedder.encode(
+            documents, batch_size=self.encode_batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+    
+    def _embedding_cache_path(self) -> Path:
+        return self.persist_directory / f"emb_cache_{self.embedder_id}.npz"
+    
+    def _load_embedding_cache(self) -> Dict[str, np.ndarray]:
+        if self._embedding_cache is None:
+            self._embedding_cache = {}
+            try:
+                with np.load(self._embedding_cache_path()) as data:
+                    self._embedding_cache = dict(zip(data["keys"].tolist(), data["embeddings"]))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable embedding cache: {e}")
+        return self._embedding_cache
+    
+    def _save_embedding_cache(self):
+        """Write the embedding cache atomically so a crash never leaves a truncated file"""
+        path = self._embedding_cache_path()
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    keys=np.array(list(self._embedding_cache)),
+                    embeddings=np.stack(list(self._embedding_cache.values()))
+                )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to save embedding cache: {e}")
+    
+    def _encode_query(self, text: str) -> np.ndarray:
+        embedding = np.asarray(self.embedder.encode([text], normalize_embeddings=True)[0], dtype=np.float32)
+        embedding.flags.writeable = False  # Shared by every caller of the cache
+        return embedding
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a search query, reusing the vector for text seen recently"""
+        return self._embed_query_cached(text)
     
     def search_relevant_fields(self, query: str, n_results: int = 10) -> List[Dict[str, Any]]:
         """Search for relevant field descriptions based on the query"""
-        query_embedding = self.embedder.encode([query]).tolist()
-        
+        return self.search_relevant_fields_by_vector(self.embed_query(query), n_results)
+    
+    def search_relevant_fields_by_vector(self, query_embedding: np.ndarray, n_results: int = 10) -> List[Dict[str, Any]]:
+        """Search for relevant field descriptions near an already-computed query embedding"""
         results = self.field_descriptions_collection.query(
-            query_embeddings=query_embedding,
+            query_embeddings=[query_embedding],
             n_results=n_results
         )
         
@@ -230,10 +507,12 @@ class VectorStore:
     
     def search_relevant_values(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Search for relevant field values based on the query"""
-        query_embedding = self.embedder.encode([query]).tolist()
-        
+        return self.search_relevant_values_by_vector(self.embed_query(query), n_results)
+    
+    def search_relevant_values_by_vector(self, query_embedding: np.ndarray, n_results: int = 5) -> List[Dict[str, Any]]:
+        """Search for relevant field values near an already-computed query embedding"""
         results = self.field_values_collection.query(
-            query_embeddings=query_embedding,
+            query_embeddings=[query_embedding],
             n_results=n_results
         )
         
@@ -241,17 +520,19 @@ class VectorStore:
         if results['metadatas'] and results['metadatas'][0]:
             for metadata in results['metadatas'][0]:
                 # Parse sample values back from JSON
-                metadata['sample_values'] = json.loads(metadata['sample_values'])
+                metadata['sample_values'] = msgspec.json.decode(metadata['sample_values'])
                 relevant_values.append(metadata)
         
         return relevant_values
     
     def search_relevant_schemas(self, query: str, n_results: int = 3) -> List[Dict[str, Any]]:
         """Search for relevant schemas based on the query"""
-        query_embedding = self.embedder.encode([query]).tolist()
-        
+        return self.search_relevant_schemas_by_vector(self.embed_query(query), n_results)
+    
+    def search_relevant_schemas_by_vector(self, query_embedding: np.ndarray, n_results: int = 3) -> List[Dict[str, Any]]:
+        """Search for relevant schemas near an already-computed query embedding"""
         results = self.schemas_collection.query(
-            query_embeddings=query_embedding,
+            query_embeddings=[query_embedding],
             n_results=n_results
         )
         
@@ -264,10 +545,12 @@ class VectorStore:
     
     def search_similar_queries(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Search for similar ground truth queries"""
-        query_embedding = self.embedder.encode([query]).tolist()
-        
+        return self.search_similar_queries_by_vector(self.embed_query(query), n_results)
+    
+    def search_similar_queries_by_vector(self, query_embedding: np.ndarray, n_results: int = 5) -> List[Dict[str, Any]]:
+        """Search for similar ground truth queries near an already-computed query embedding"""
         results = self.ground_truth_collection.query(
-            query_embeddings=query_embedding,
+            query_embeddings=[query_embedding],
             n_results=n_results
         )
         
@@ -278,6 +561,23 @@ class VectorStore:
         
         return similar_queries
     
+    def save_manifest(self, workspace_id: str, tables: List[str]):
+        """Record which workspace and tables the persisted collections were built from"""
+        manifest = {
+            "workspace_id": workspace_id,
+            "table_hash": hashlib.sha256("\n".join(sorted(tables)).encode("utf-8")).hexdigest(),
+            "embedder_id": self.embedder_id,
+            "timestamp": time.time()
+        }
+        (self.persist_directory / "manifest.json").write_text(json.dumps(manifest))
+    
+    def load_manifest(self) -> Optional[Dict[str, Any]]:
+        """Return the manifest written by the last successful population, if any"""
+        try:
+            return json.loads((self.persist_directory / "manifest.json").read_text())
+        except (OSError, ValueError):
+            return None
+    
     def get_collection_stats(self) -> Dict[str, int]:
         """Get statistics about the collections"""
         return {
@@ -294,18 +594,17 @@ class MockEmbedder:
         self.embedding_dim = 384  # Same as all-MiniLM-L6-v2
         logger.warning("Using MockEmbedder - embeddings will be random vectors for testing only")
     
-    def encode(self, texts):
+    def encode(self, texts, **kwargs):
         """Generate random embeddings for testing"""
-        import numpy as np
         if isinstance(texts, str):
             texts = [texts]
         
-        # Generate random embeddings with consistent seed for reproducibility
-        np.random.seed(hash(' '.join(texts)) % 2**32)
-        embeddings = np.random.normal(0, 1, (len(texts), self.embedding_dim))
+        # Generate random embeddings with consistent seed for reproducibility; a local generator
+        # leaves the global NumPy random state alone and is safe to use from worker threads
+        rng = np.random.default_rng(hash(' '.join(texts)) & 0xFFFFFFFF)
+        embeddings = rng.standard_normal((len(texts), self.embedding_dim), dtype=np.float32)
         
-        # Normalize embeddings
-        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-        embeddings = embeddings / norms
+        # Normalize embeddings in place
+        embeddings /= np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))[:, None]
         
-        return embeddings 
\ No newline at end of file
+        return embeddings
@@ -1,5 +1,6 @@
+import asyncio
 import chainlit as cl
-import requests
+import httpx
 import os
 import pandas as pd
 import json
@@ -7,16 +8,20 @@ import time
 
 API_URL = os.getenv("NL2KQL_API_URL", "http://localhost:8000")
 
-import openlit
+# Async keep-alive client so a slow API call does not block the UI for every other chat session
+api_client = httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=5.0))
 
-openlit.init(otlp_endpoint="http://localhost:4318")
+# Telemetry export opens a connection to the OTLP collector, so it is opt-in
+if os.getenv("ENABLE_OPENLIT") == "1":
+    import openlit
+    openlit.init(otlp_endpoint="http://localhost:4318", service_name="nl2kql-chainlit")
 
 @cl.on_chat_start
 async def start():
     """Welcome message and RAG workflow status check"""
     # Check RAG workflow status
     try:
-        status_response = requests.get(f"{API_URL}/rag-status")
+        status_response = await api_client.get(f"{API_URL}/rag-status")
         if status_response.status_code == 200:
             status_data = status_response.json()
             is_initialized = status_data.get("initialized", False)
@@ -81,9 +86,9 @@ async def main(message: cl.Message):
     await processing_msg.send()
     
     try:
-        # First, call the detailed endpoint to get RAG information
+        # Call the detailed endpoint to get RAG information
         detailed_start = time.time()
-        detailed_response = requests.post(
+        detailed_response = await api_client.post(
             f"{API_URL}/nl2kql/detailed", 
             json={
                 "natural_language": nl,
@@ -94,6 +99,18 @@ async def main(message: cl.Message):
         
         if detailed_response.status_code == 200:
             detailed_data = detailed_response.json()
+            kql = detailed_data.get("kql_query", "")
+            
+            # Only a valid query is executed. /execute is started now so it runs while the steps
+            # below are rendered; it finds this generation in the server's result cache
+            execute_task = None
+            if detailed_data.get("is_valid", False) and kql.strip():
+                execution_start = time.time()
+                execute_task = asyncio.create_task(
+                    api_client.post(f"{API_URL}/execute", json={"natural_language": nl})
+                )
+                # Mark a failure as retrieved in case rendering fails before the task is awaited
+                execute_task.add_done_callback(lambda task: task.cancelled() or task.exception())
             
             # Show timing for KQL generation
             timing_msg = f"⏱️ **KQL Generation completed in {detailed_time:.2f} seconds**"
@@ -106,15 +123,12 @@ async def main(message: cl.Message):
                 # Show fallback mode information
                 await show_fallback_mode(detailed_data)
             
-            # Get the KQL query
-            kql = detailed_data.get("kql_query", "")
-            
             # Show KQL generation result
             await show_kql_result(detailed_data, kql)
             
-            # Now execute the query if it's valid
-            if detailed_data.get("is_valid", False) and kql.strip():
-                await execute_and_show_results(nl, kql)
+            # Now show the execution results if the query was valid
+            if execute_task is not None:
+                await execute_and_show_results(execute_task, execution_start, kql)
             else:
                 await cl.Message(
                     content="⚠️ Generated KQL has validation issues. Execution skipped for safety.",
@@ -139,7 +153,7 @@ async def main(message: cl.Message):
         ).send()
 
 async def show_rag_steps(detailed_data):
-    """Show the RAG workflow steps and context used"""
+    """Show the RAG workflow steps and context used as a single message"""
     context_used = detailed_data.get("context_used", {})
     
     # Step 1: Context Retrieval
@@ -148,8 +162,7 @@ async def show_rag_steps(detailed_data):
 • Discovered {context_used.get('tables_considered', 0)} relevant tables
 • Retrieved {context_used.get('similar_queries_found', 0)} similar query patterns
 • Context: {context_used.get('context_summary', 'No summary available')}"""
-    
-    await cl.Message(content=retrieval_info, author="RAG Workflow").send()
+    sections = [retrieval_info]
     
     # Step 1.5: Show what was actually retrieved (if available)
     if context_used.get('tables_considered', 0) > 0:
@@ -158,8 +171,7 @@ async def show_rag_steps(detailed_data):
 • **Field Analysis**: {context_used.get('fields_considered', 0)} fields were analyzed for relevance
 • **Pattern Matching**: {context_used.get('similar_queries_found', 0)} similar queries found in knowledge base
 • **Schema Context**: {context_used.get('context_summary', 'Schema information retrieved')}"""
-        
-        await cl.Message(content=context_details, author="RAG Workflow").send()
+        sections.append(context_details)
     
     # Step 2: Processing & Refinement
     processing_info = """🔄 **Step 2: Context Processing & Refinement**
@@ -167,8 +179,7 @@ async def show_rag_steps(detailed_data):
 • Filtering sample values based on query intent
 • Extracting patterns from similar successful queries
 • Building enhanced context for LLM generation"""
-    
-    await cl.Message(content=processing_info, author="RAG Workflow").send()
+    sections.append(processing_info)
     
     # Step 3: Generation with Context
     generation_info = """🤖 **Step 3: KQL Generation with Enhanced Context**
@@ -176,8 +187,7 @@ async def show_rag_steps(detailed_data):
 • Using specialized KQL generation prompts
 • Ensuring field names match actual schema
 • Applying learned patterns from similar queries"""
-    
-    await cl.Message(content=generation_info, author="RAG Workflow").send()
+    sections.append(generation_info)
     
     # Step 4: Validation & Quality
     complexity = detailed_data.get("complexity_analysis", {})
@@ -191,16 +201,17 @@ async def show_rag_steps(detailed_data):
     
     if warnings:
         quality_info += f"\n• Warning Details: {'; '.join(warnings[:3])}"
-    
-    await cl.Message(content=quality_info, author="RAG Workflow").send()
+    sections.append(quality_info)
     
     # Step 5: Final Result
     result_info = """🎯 **Step 5: Final Result**
 • KQL query validated and corrected if needed
 • Complexity analysis completed
 • Ready for execution against Log Analytics workspace"""
+    sections.append(result_info)
     
-    await cl.Message(content=result_info, author="RAG Workflow").send()
+    # One message instead of one per step: a single round trip to the browser and one stored message
+    await cl.Message(content="\n\n".join(sections), author="RAG Workflow").send()
 
 async def show_kql_result(detailed_data, kql):
     """Show the generated KQL with quality indicators"""
@@ -233,17 +244,15 @@ async def show_kql_result(detailed_data, kql):
     
     await cl.Message(content=kql_content, author="NL2KQL Bot").send()
 
-async def execute_and_show_results(nl, kql):
-    """Execute the KQL query and show results"""
+async def execute_and_show_results(execute_task, execution_start, kql):
+    """Wait for the already-started /execute call and show its results"""
     execution_msg = cl.Message(
         content="🚀 Executing query against Log Analytics...",
         author="NL2KQL Bot"
     )
     await execution_msg.send()
     
-    # Call the execute endpoint
-    execution_start = time.time()
-    response = requests.post(f"{API_URL}/execute", json={"natural_language": nl})
+    response = await execute_task
     execution_time = time.time() - execution_start
     
     # Show execution timing
@@ -254,6 +263,13 @@ async def execute_and_show_results(nl, kql):
         data = response.json()
         result = data.get("data", [])
         
+        # The server regenerates the query when its result cache is disabled or has expired
+        if data.get("kql_query", kql) != kql:
+            await cl.Message(
+                content=f"ℹ️ The results below are for a regenerated query:\n```kql\n{data['kql_query']}\n```",
+                author="NL2KQL Bot"
+            ).send()
+        
         if not result:
             await cl.Message(
                 content="📭 Query executed successfully but returned no data.",
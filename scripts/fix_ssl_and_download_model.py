@@ -8,11 +8,45 @@ This script attempts to:
 3. Test the model loading
 """
 
+import numpy as np
 import os
 import ssl
 import certifi
 import sys
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+HF_MODEL_NAME = f"sentence-transformers/{MODEL_NAME}"
+WARMUP_TEXT = "This is a test sentence."
+# Seconds to wait on a single hub request before giving up on it
+_HUB_TIMEOUT_SECONDS = 10
+
+def _warmup_path(device: str) -> Optional[Path]:
+    """Where the reference embedding of WARMUP_TEXT is kept for the cached model revision and a device
+    
+    None if the model is not in the HF cache. Keying on the snapshot revision keeps a model
+    update from being compared with a vector from the previous revision.
+    """
+    from huggingface_hub import try_to_load_from_cache
+    
+    config_path = try_to_load_from_cache(repo_id=HF_MODEL_NAME, filename="config.json")
+    if not isinstance(config_path, str):
+        return None
+    revision = Path(config_path).parent.name
+    return Path.home() / ".cache" / "nl2kql" / f"warmup_{MODEL_NAME}_{revision}_{device}.npy"
+
+def _save_reference_embedding(embedding, device):
+    """Write the reference embedding atomically, so a reader never sees a partial file"""
+    path = _warmup_path(device)
+    if path is None:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, embedding)
+    os.replace(tmp_path, path)
 
 def fix_ssl_certificates():
     """Fix SSL certificate issues"""
@@ -32,66 +66,118 @@ def fix_ssl_certificates():
     
     return True
 
-def download_model():
-    """Download the sentence transformer model"""
+def enable_fast_downloads():
+    """Use the parallel native downloaders of huggingface_hub for the model files"""
+    # huggingface_hub >= 1.0 downloads through hf_xet; this lets it use all cores and more bandwidth
+    os.environ.setdefault("HF_XET_HIGH_PERFORMANCE", "1")
+    
+    # Older huggingface_hub releases use hf_transfer instead, and fail if it is enabled but missing
     try:
-        print("Attempting to download sentence transformer model...")
-        
-        # Try different approaches
-        approaches = [
-            lambda: download_with_huggingface_hub(),
-            lambda: download_with_sentence_transformers(),
-            lambda: download_with_offline_mode()
-        ]
-        
-        for i, approach in enumerate(approaches, 1):
-            try:
-                print(f"Approach {i}: {approach.__name__}")
-                result = approach()
-                if result:
-                    print(f"Success with approach {i}")
-                    return True
-            except Exception as e:
-                print(f"Approach {i} failed: {e}")
-                continue
-        
-        print("All download approaches failed")
-        return False
-        
+        import hf_transfer  # noqa: F401
+        os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+    except ImportError:
+        pass
+
+def limit_torch_threads():
+    """Cap CPU threads for model inference before torch is first imported
+    
+    MiniLM encode does not scale past a handful of cores; larger default pools
+    oversubscribe the CPU and run slower.
+    """
+    threads = min(8, os.cpu_count() or 4)
+    # BLAS/OpenMP read these at import time, so they must be set before torch loads
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, str(threads))
+    
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+        print(f"Torch limited to {threads} intra-op threads")
     except Exception as e:
-        print(f"Error downloading model: {e}")
-        return False
+        print(f"Could not configure torch threads: {e}")
+
+def _detect_device():
+    """Pick CUDA, then Apple MPS, then CPU for loading the model"""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except Exception:
+        pass
+    return "cpu"
+
+@lru_cache(maxsize=None)
+def _get_embedder(model_name, device):
+    """Load a SentenceTransformer once per process and device"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device=device)
+
+def _model_in_hf_cache():
+    """Whether the model is already in the default HF cache (the one SentenceTransformer reads)"""
+    from huggingface_hub import try_to_load_from_cache
+    
+    return isinstance(try_to_load_from_cache(repo_id=HF_MODEL_NAME, filename="config.json"), str)
+
+def download_model():
+    """Download the sentence transformer model
+    
+    An already cached model returns straight away. Otherwise the approaches are
+    tried one after the other; both fetch the same files from the hub, so running
+    them concurrently would only duplicate the download.
+    """
+    print("Attempting to download sentence transformer model...")
+    
+    # Bound each hub request so an unreachable hub fails instead of hanging the script.
+    # huggingface_hub reads these when it is first imported
+    os.environ.setdefault("HF_HUB_ETAG_TIMEOUT", str(_HUB_TIMEOUT_SECONDS))
+    os.environ.setdefault("HF_HUB_DOWNLOAD_TIMEOUT", str(_HUB_TIMEOUT_SECONDS))
+    
+    if _model_in_hf_cache():
+        print(f"{HF_MODEL_NAME} is already in the Hugging Face cache")
+        return True
+    
+    for approach in (download_with_huggingface_hub, download_with_sentence_transformers):
+        try:
+            if approach():
+                print(f"Success with {approach.__name__}")
+                return True
+        except Exception as e:
+            print(f"{approach.__name__} failed: {e}")
+    
+    print("All download approaches failed")
+    return False
 
 def download_with_huggingface_hub():
     """Try downloading with huggingface_hub"""
     from huggingface_hub import snapshot_download
     
-    model_name = "sentence-transformers/all-MiniLM-L6-v2"
-    cache_dir = Path.home() / ".cache" / "huggingface" / "transformers"
-    
-    print(f"Downloading {model_name} to {cache_dir}")
-    snapshot_download(repo_id=model_name, cache_dir=cache_dir)
+    print(f"Downloading {HF_MODEL_NAME} to the Hugging Face cache")
+    snapshot_download(repo_id=HF_MODEL_NAME, etag_timeout=_HUB_TIMEOUT_SECONDS)
     return True
 
 def download_with_sentence_transformers():
     """Try downloading with sentence_transformers directly"""
-    from sentence_transformers import SentenceTransformer
+    device = _detect_device()
+    print(f"Loading sentence transformer model on {device}...")
+    model = _get_embedder(MODEL_NAME, device)
     
-    print("Loading sentence transformer model...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    # Make sure the Rust tokenizer is in use (and cached); the Python one dominates short-text encode time
+    if not getattr(model.tokenizer, "is_fast", False):
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_NAME, use_fast=True)
+        if tokenizer.is_fast:
+            model.tokenizer = tokenizer
+        else:
+            print("Warning: fast tokenizer unavailable, install the 'tokenizers' package")
+    print(f"Tokenizer: {type(model.tokenizer).__name__}")
     
-    # Test the model
-    test_text = "This is a test sentence."
-    embedding = model.encode([test_text])
+    # Test the model, keeping the embedding as the reference for test_vector_store
+    embedding = model.encode([WARMUP_TEXT], normalize_embeddings=True)
     print(f"Model loaded successfully. Test embedding shape: {embedding.shape}")
-    return True
-
-def download_with_offline_mode():
-    """Try using offline mode if model exists"""
-    from sentence_transformers import SentenceTransformer
-    
-    print("Attempting to load model in offline mode...")
-    model = SentenceTransformer('all-MiniLM-L6-v2', local_files_only=True)
+    _save_reference_embedding(embedding[0], device)
     return True
 
 def test_vector_store():
@@ -102,15 +188,36 @@ def test_vector_store():
         
         from app.vector_store import VectorStore
         
+        # Creating the store also fetches or exports the int8 ONNX model into the persist
+        # directory, so the API server finds it ready on its first start
         print("Creating vector store instance...")
         vs = VectorStore()
+        print(f"Vector store embedder: {vs.embedder_id or 'MockEmbedder'} on {vs.device}")
         
         print("Testing embedding generation...")
-        # This should work with either real model or MockEmbedder
-        test_docs = ["test document 1", "test document 2"]
-        embeddings = vs.embedder.encode(test_docs)
+        # This should work with either real model or MockEmbedder. The warm-up sentence goes
+        # in the same batch, so the reference check below costs no extra forward pass
+        test_docs = [WARMUP_TEXT, "test document 1", "test document 2"]
+        embeddings = vs.embedder.encode(
+            test_docs, batch_size=vs.encode_batch_size, normalize_embeddings=True, show_progress_bar=False
+        )
         print(f"Embeddings generated successfully. Shape: {embeddings.shape}")
         
+        # Compare with the full-precision reference saved by download_with_sentence_transformers in
+        # this or an earlier run; there is none when the model only ever came from the cache.
+        # The store may run an int8/fp16 variant, so this checks cosine similarity, not exact equality
+        warmup_path = _warmup_path(vs.device)
+        if vs.embedder_id and warmup_path is not None and warmup_path.exists():
+            try:
+                reference = np.load(warmup_path)
+            except (OSError, ValueError) as e:
+                print(f"Unreadable reference embedding: {e}")
+            else:
+                similarity = float(np.dot(reference, embeddings[0]))
+                print(f"Similarity to the reference embedding: {similarity:.4f}")
+                if similarity < 0.98:
+                    print("Warning: the vector store embedder diverges from the reference model")
+        
         return True
         
     except Exception as e:
@@ -128,6 +235,9 @@ def main():
         print("Failed to fix SSL certificates")
         return False
     
+    limit_torch_threads()
+    enable_fast_downloads()
+    
     # Step 2: Try to download model
     print("\n2. Downloading sentence transformer model...")
     model_downloaded = download_model()
@@ -10,30 +10,44 @@ This script helps initialize the multi-RAG workflow by:
 
 Usage:
     python scripts/prepare_data.py --workspace-id <your-workspace-id>
+
+On a CUDA GPU the embedder runs in FP16; set EMBEDDER_HALF_PRECISION=false
+to build the vector stores with FP32 embeddings instead.
 """
 
 import sys
 import os
 import asyncio
 import argparse
+import atexit
 import logging
+import logging.handlers
+import queue
 from pathlib import Path
 
 # Add the app directory to the Python path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from app.multi_rag_workflow import multi_rag_workflow
+from app.azure_clients import close_azure_clients
 from app.config import settings
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('data_preparation.log')
-    ]
-)
+# Configure logging: records are queued and written to the console and log file by a
+# background thread, so concurrent table processing never waits on disk I/O
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.StreamHandler(), logging.FileHandler('data_preparation.log')]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# The queue handler passes records through unformatted; the listener's handlers format them
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +56,7 @@ async def main():
     parser.add_argument('--workspace-id', required=True, help='Azure Log Analytics Workspace ID')
     parser.add_argument('--force-refresh', action='store_true', help='Force refresh of existing data')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be done without actually doing it')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum Log Analytics queries in flight while processing tables')
     
     args = parser.parse_args()
     
@@ -49,6 +64,7 @@ async def main():
     logger.info(f"Workspace ID: {args.workspace_id}")
     logger.info(f"Force Refresh: {args.force_refresh}")
     logger.info(f"Dry Run: {args.dry_run}")
+    logger.info(f"Concurrency: {args.concurrency}")
     
     # Validate configuration
     if not settings.azure_openai_endpoint or not settings.azure_openai_key:
@@ -64,14 +80,14 @@ async def main():
             logger.info(f"Current RAG workflow status: {status}")
             
             # Discover tables (without processing)
-            tables = multi_rag_workflow.schema_generator.discover_tables(args.workspace_id)
+            tables = await multi_rag_workflow.schema_generator.discover_tables(args.workspace_id)
             logger.info(f"Would process {len(tables)} tables: {tables[:10]}...")
             
             logger.info("Dry run completed. Use --force-refresh to actually initialize the workflow.")
         else:
             # Initialize the workflow
             logger.info("Initializing Multi-RAG Workflow...")
-            await multi_rag_workflow.initialize_workflow(args.workspace_id, args.force_refresh)
+            await multi_rag_workflow.initialize_workflow(args.workspace_id, args.force_refresh, concurrency=args.concurrency)
             
             # Show final status
             status = multi_rag_workflow.get_workflow_status()
@@ -91,6 +107,8 @@ async def main():
     except Exception as e:
         logger.error(f"Data preparation failed: {e}")
         sys.exit(1)
+    finally:
+        await close_azure_clients()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
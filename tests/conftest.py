@@ -0,0 +1,24 @@
+from unittest import mock
+
+import pytest
+
+# A query the validator accepts unchanged, so it comes back verbatim from the fallback path too
+MOCK_KQL = "SecurityEvent | where TimeGenerated > ago(1d) | count"
+
+# get_kql_from_nl is imported by name into these modules, so each binding is patched
+_GET_KQL_FROM_NL_TARGETS = (
+    "app.azure_openai_client.get_kql_from_nl",
+    "app.multi_rag_workflow.get_kql_from_nl",
+    "app.nlp2kql.get_kql_from_nl",
+)
+
+@pytest.fixture(scope="session", autouse=True)
+def mock_openai():
+    """Answer every basic KQL generation with MOCK_KQL instead of calling Azure OpenAI"""
+    get_kql_from_nl = mock.AsyncMock(return_value=MOCK_KQL)
+    patchers = [mock.patch(target, get_kql_from_nl) for target in _GET_KQL_FROM_NL_TARGETS]
+    for patcher in patchers:
+        patcher.start()
+    yield get_kql_from_nl
+    for patcher in reversed(patchers):
+        patcher.stop()
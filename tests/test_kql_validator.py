@@ -0,0 +1,57 @@
+from app.kql_validator import KQLValidator
+
+def test_correct_function_names_are_left_alone():
+    query = "SecurityEvent\n| where TimeGenerated > ago(1d)\n| where strlen(Account) > 3 and isnotnull(Computer)"
+    assert KQLValidator().validate_and_correct(query) == (query, [], True)
+
+def test_wrong_function_name_is_corrected():
+    corrected, warnings, is_valid = KQLValidator().validate_and_correct(
+        "SecurityEvent\n| where TimeGenerated > ago(1d)\n| where length(Account) > 3"
+    )
+    assert corrected == "SecurityEvent\n| where TimeGenerated > ago(1d)\n| where strlen(Account) > 3"
+    assert warnings == ["Corrected function name: length( -> strlen("]
+    assert is_valid
+
+def test_take_and_limit_match_whole_words():
+    validator = KQLValidator()
+    _, warnings, _ = validator.validate_and_correct(
+        "SecurityEvent\n| where TimeGenerated > ago(1d)\n| extend limited = true\n| take 10"
+    )
+    assert warnings == []
+    _, warnings, _ = validator.validate_and_correct(
+        "SecurityEvent\n| where TimeGenerated > ago(1d)\n| take 10\n| limit 5"
+    )
+    assert warnings == ["Use either 'take' or 'limit', not both"]
+
+def test_time_filter_format_is_corrected():
+    corrected, warnings, _ = KQLValidator().validate_and_correct("SecurityEvent\n| where TimeGenerated > ago(7 days)")
+    assert corrected == "SecurityEvent\n| where TimeGenerated > ago(7d)"
+    assert warnings == ["Corrected time filter format"]
+
+def test_table_name_is_corrected_from_available_tables():
+    corrected, warnings, is_valid = KQLValidator().validate_and_correct(
+        "SecurityEvnt\n| where TimeGenerated > ago(1d)", ["SecurityEvent", "Syslog"]
+    )
+    assert corrected == "SecurityEvent\n| where TimeGenerated > ago(1d)"
+    assert warnings == ["Corrected table name 'SecurityEvnt' to 'SecurityEvent'"]
+    assert is_valid
+
+def test_warnings_are_grouped_by_check():
+    corrected, warnings, is_valid = KQLValidator().validate_and_correct(
+        '| SecurityEvnt\n| summarize by Computer\n| where Name = "x"\n| where len(Name) > 1;', ["SecurityEvent"]
+    )
+    assert corrected == 'SecurityEvent\n| summarize by Computer\n| where Name == "x"\n| where strlen(Name) > 1'
+    assert warnings == [
+        "Removed unnecessary semicolon at end of query",
+        "Removed unnecessary pipe at beginning of query",
+        "Corrected table name 'SecurityEvnt' to 'SecurityEvent'",
+        "Consider adding a TimeGenerated filter for better performance",
+        "Summarize statement should include aggregation functions",
+        "Corrected function name: len( -> strlen(",
+        "Changed assignment operator (=) to comparison operator (==) for string comparison",
+    ]
+    assert is_valid
+
+def test_unbalanced_parentheses_are_invalid():
+    _, _, is_valid = KQLValidator().validate_and_correct("SecurityEvent\n| where TimeGenerated > ago(1d")
+    assert not is_valid